@@ -0,0 +1,198 @@
+#!/usr/bin/python
+
+# @file bench_dlnap.py
+# @brief Offline benchmarks of dlnap on top of simulated renderers (see fake_renderer.py).
+#
+# Usage: bench_dlnap.py [--devices <n,n,..>] [--calls <n>] [--latency <ms>] [--response-size <bytes>]
+#                       [--proxy-size <MB>] [--library-size <n>] [--page-size <n>]
+#                       [--only discover|control|parse|browse|proxy]
+
+import os
+import sys
+import time
+import getopt
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dlnap'))
+
+import dlnap
+from fake_renderer import FakeRenderer
+
+def _percentile(values, p):
+   values = sorted(values)
+   return values[min(len(values) - 1, int(len(values) * p))]
+
+def _report(name, times, ops = None):
+   line = '{:<40} avg {:8.3f} ms  p50 {:8.3f} ms  p95 {:8.3f} ms'.format(
+      name, sum(times) / len(times) * 1000, _percentile(times, 0.5) * 1000, _percentile(times, 0.95) * 1000)
+   if ops is not None:
+      line += '  {:10.1f} ops/s'.format(ops)
+   print(line)
+
+class _LastDescription(dlnap.Metrics):
+   """ Remembers when the last device description was fetched.
+   """
+
+   def __init__(self):
+      self.last = None
+
+   def timing(self, event, seconds, **tags):
+      if event == 'description.fetch':
+         self.last = time.time()
+
+def bench_discover(counts, latency):
+   """ Time to discover N devices: from M-SEARCH until the last device description is fetched.
+
+   discover() itself always returns after its timeout, so that is reported separately.
+   """
+   print('== discover')
+   for count in counts:
+      metrics = _LastDescription()
+      dlnap.set_metrics(metrics)
+      with FakeRenderer(count=count, latency=latency) as renderer:
+         start = time.time()
+         devices = dlnap.discover(timeout=0.5, st=dlnap.URN_AVTransport_Fmt, group=renderer.ssdp_address)
+         returned = time.time() - start
+      dlnap.set_metrics(None)
+      found = metrics.last - start if metrics.last is not None else float('nan')
+      print('{:<40} {:8.3f} s  found {}/{}  (discover returned after {:.3f} s)'.format(
+            'discover {} devices'.format(count), found, len(devices), count, returned))
+
+def bench_control(calls, latency, response_size):
+   """ Control call latency and throughput against single device.
+   """
+   print('== control')
+   with FakeRenderer(count=1, latency=latency, response_size=response_size) as renderer:
+      d = dlnap.discover(timeout=0.2, st=dlnap.URN_AVTransport_Fmt, group=renderer.ssdp_address)[0]
+
+      for name, call in (('GetTransportInfo', d.info),
+                         ('GetMediaInfo ({} B metadata)'.format(response_size), d.media_info),
+                         ('SetVolume', lambda: d.volume(20))):
+         times = []
+         start = time.time()
+         for i in range(calls):
+            t = time.time()
+            call()
+            times.append(time.time() - t)
+         _report(name, times, calls / (time.time() - start))
+
+      # slider drag: many volume changes queued at once, superseded ones are coalesced
+      d.start_scheduler()
+      sent_before = renderer.requests('SetVolume')
+      start = time.time()
+      futures = [d.volume(i % 100) for i in range(calls)]
+      futures[-1].result()
+      elapsed = time.time() - start
+      d.stop_scheduler()
+      print('{:<40} {:8.3f} ms  {} of {} requests sent'.format('SetVolume x{} via scheduler'.format(calls),
+            elapsed * 1000, renderer.requests('SetVolume') - sent_before, calls))
+
+def bench_parse(calls, response_size):
+   """ _xml2dict speed on device description and SOAP responses.
+   """
+   print('== parse')
+   from fake_renderer import FakeDevice, SOAP_RESPONSE
+   description = FakeRenderer().description(FakeDevice(0))
+   fields = '<CurrentURI>http://x/y.mp3</CurrentURI><CurrentURIMetaData>{}</CurrentURIMetaData>'.format('x' * response_size)
+   response = SOAP_RESPONSE.format(action='GetMediaInfo', urn=dlnap.URN_AVTransport, fields=fields)
+
+   for name, xml in (('description xml ({} B)'.format(len(description)), description),
+                     ('soap response ({} B)'.format(len(response)), response)):
+      times = []
+      start = time.time()
+      for i in range(calls):
+         t = time.time()
+         dlnap._xml2dict(xml, True)
+         times.append(time.time() - t)
+      _report('_xml2dict ' + name, times, calls / (time.time() - start))
+
+def bench_browse(library_size, page_size):
+   """ Paging through large ContentDirectory container, with and without page cache.
+   """
+   print('== browse')
+   with FakeRenderer(library_size=library_size) as renderer:
+      d = dlnap.discover(timeout=0.2, st=dlnap.URN_AVTransport_Fmt, group=renderer.ssdp_address)[0]
+      cd = dlnap.ContentDirectory(d, page_size=page_size, cache_size=library_size // page_size + 1)
+      for name in ('browse {} tracks, page {}'.format(library_size, page_size), 'browse again from cache'):
+         start = time.time()
+         count = sum(1 for obj in cd.browse('1'))
+         elapsed = time.time() - start
+         print('{:<40} {:8.3f} s  {:10.1f} objects/s  ({} objects)'.format(name, elapsed, count / elapsed, count))
+
+def bench_proxy(size):
+   """ DownloadProxy streaming throughput for local file and http upstream.
+   """
+   print('== proxy')
+   if dlnap.py3:
+      from urllib.request import urlopen
+   else:
+      from urllib2 import urlopen
+
+   httpd = dlnap.startProxy('127.0.0.1', 0)
+   port = httpd.server_address[1]
+   fd, path = tempfile.mkstemp(suffix='.bin')
+   try:
+      with os.fdopen(fd, 'wb') as f:
+         f.write(b'\0' * size)
+
+      with FakeRenderer() as renderer:
+         upstream = 'http://{}:{}/media/{}'.format(renderer.http_address[0], renderer.http_address[1], size)
+         for name, url in (('local file', path), ('http upstream', upstream)):
+            start = time.time()
+            r = urlopen('http://127.0.0.1:{}{}'.format(port, dlnap.proxy_path(url)))
+            received = 0
+            while True:
+               chunk = r.read(64 * 1024)
+               if not chunk:
+                  break
+               received += len(chunk)
+            elapsed = time.time() - start
+            print('{:<40} {:8.3f} s  {:8.1f} MB/s'.format('{} {} MB'.format(name, received // (1024 * 1024)), elapsed, received / elapsed / 1024 / 1024))
+   finally:
+      httpd.shutdown()
+      os.remove(path)
+
+def main():
+   opts, args = getopt.getopt(sys.argv[1:], '', ['devices=', 'calls=', 'latency=', 'response-size=', 'proxy-size=',
+                                                 'library-size=', 'page-size=', 'only='])
+   counts = [1, 10, 50]
+   calls = 200
+   latency = 0
+   response_size = 4096
+   proxy_size = 64
+   library_size = 10000
+   page_size = 200
+   only = ''
+   for opt, arg in opts:
+      if opt == '--devices':
+         counts = [int(n) for n in arg.split(',')]
+      elif opt == '--calls':
+         calls = int(arg)
+      elif opt == '--latency':
+         latency = float(arg) / 1000
+      elif opt == '--response-size':
+         response_size = int(arg)
+      elif opt == '--proxy-size':
+         proxy_size = int(arg)
+      elif opt == '--library-size':
+         library_size = int(arg)
+      elif opt == '--page-size':
+         page_size = int(arg)
+      elif opt == '--only':
+         only = arg
+
+   logging.basicConfig(level=logging.CRITICAL)
+   if only in ('', 'discover'):
+      bench_discover(counts, latency)
+   if only in ('', 'control'):
+      bench_control(calls, latency, response_size)
+   if only in ('', 'parse'):
+      bench_parse(calls, response_size)
+   if only in ('', 'browse'):
+      bench_browse(library_size, page_size)
+   if only in ('', 'proxy'):
+      bench_proxy(proxy_size * 1024 * 1024)
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,81 @@
+#!/usr/bin/python
+
+# @file bench_import.py
+# @brief Measure dlnap import time and check that library import stays lightweight.
+#
+# Every run imports dlnap in a fresh interpreter, so the numbers are cold start costs.
+# Exits with non zero code if import pulls proxy/CLI-only modules or installs signal handlers.
+#
+# Usage: bench_import.py [--runs <count>] [--max-ms <milliseconds>]
+
+import os
+import sys
+import json
+import getopt
+import subprocess
+
+DLNAP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dlnap')
+
+# Modules which must be loaded on demand only
+HEAVY_MODULES = ('http.server', 'BaseHTTPServer', 'urllib.request', 'urllib2', 'shutil',
+                 'mimetypes', 'socketserver', 'SocketServer', 'concurrent.futures', 'ssl', 'email')
+
+PROBE = """
+import sys, time, signal, json
+if PRELOAD and sys.version_info < (3, 7):
+   # no module __getattr__: DownloadProxy is created at import, its modules are expected
+   import mimetypes
+   if sys.version_info[0] == 3:
+      import http.server
+   else:
+      import BaseHTTPServer
+before = set(sys.modules)
+start = time.time()
+import dlnap
+elapsed = time.time() - start
+print(json.dumps({
+   'elapsed': elapsed,
+   'modules': sorted(set(sys.modules) - before),
+   'sigint_default': signal.getsignal(signal.SIGINT) is signal.default_int_handler,
+}))
+"""
+
+def probe(preload = False):
+   """ Import dlnap in a fresh interpreter.
+
+   preload -- import DownloadProxy modules beforehand on python < 3.7
+   return -- dictionary with import time, newly loaded modules and signal handler state
+   """
+   out = subprocess.check_output([sys.executable, '-c', PROBE.replace('PRELOAD', str(preload))], cwd=DLNAP_DIR)
+   return json.loads(out.decode())
+
+def main():
+   opts, args = getopt.getopt(sys.argv[1:], '', ['runs=', 'max-ms='])
+   runs = 10
+   max_ms = None
+   for opt, arg in opts:
+      if opt == '--runs':
+         runs = int(arg)
+      elif opt == '--max-ms':
+         max_ms = float(arg)
+
+   results = [probe() for i in range(runs)]
+   times = sorted(r['elapsed'] * 1000 for r in results)
+   median = times[len(times) // 2]
+   print('import dlnap: median {:.2f} ms, min {:.2f} ms, max {:.2f} ms ({} runs)'.format(median, times[0], times[-1], runs))
+
+   failed = False
+   heavy = sorted(set(m for m in probe(preload=True)['modules'] if m in HEAVY_MODULES))
+   if heavy:
+      print('FAIL: heavy modules imported: {}'.format(', '.join(heavy)))
+      failed = True
+   if not results[0]['sigint_default']:
+      print('FAIL: import replaced SIGINT handler')
+      failed = True
+   if max_ms is not None and median > max_ms:
+      print('FAIL: median import time exceeds {} ms'.format(max_ms))
+      failed = True
+   sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+   main()
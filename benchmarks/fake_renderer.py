@@ -0,0 +1,400 @@
+#!/usr/bin/python
+
+# @file fake_renderer.py
+# @brief In-process simulated DLNA MediaRenderers for offline benchmarks.
+#
+# FakeRenderer answers M-SEARCH on a loopback UDP port on behalf of 'count' devices, serves
+# their description xml and handles AVTransport/RenderingControl SOAP actions over http.
+# All devices share one http server and are told apart by url prefix /dev/<index>/.
+# With library_size > 0 devices also serve ContentDirectory: root container '0' holds
+# container '1' with library_size music tracks. With renderer=False and library_size > 0
+# devices are pure MediaServers without AVTransport and RenderingControl.
+# Like real devices each one answers M-SEARCH once per matching service.
+#
+#   renderer = FakeRenderer(count=10, latency=0.005)
+#   renderer.start()
+#   devices = dlnap.discover(group=renderer.ssdp_address, st=dlnap.URN_AVTransport_Fmt)
+#   renderer.stop()
+
+import re
+import sys
+import time
+import socket
+import threading
+
+py3 = sys.version_info[0] == 3
+if py3:
+   from socketserver import ThreadingMixIn
+   from http.server import HTTPServer
+   from http.server import BaseHTTPRequestHandler
+else:
+   from SocketServer import ThreadingMixIn
+   from BaseHTTPServer import HTTPServer
+   from BaseHTTPServer import BaseHTTPRequestHandler
+
+URN_AVTransport = "urn:schemas-upnp-org:service:AVTransport:1"
+URN_RenderingControl = "urn:schemas-upnp-org:service:RenderingControl:1"
+URN_ContentDirectory = "urn:schemas-upnp-org:service:ContentDirectory:1"
+
+DESCRIPTION = """<?xml version="1.0"?>
+<root xmlns="urn:schemas-upnp-org:device-1-0">
+   <specVersion><major>1</major><minor>0</minor></specVersion>
+   <device>
+      <deviceType>{device_type}</deviceType>
+      <friendlyName>{name}</friendlyName>
+      <manufacturer>dlnap</manufacturer>
+      <modelName>Fake Renderer</modelName>
+      <UDN>{udn}</UDN>
+      <serviceList>{services}
+      </serviceList>
+   </device>
+</root>"""
+
+SERVICE = """
+         <service>
+            <serviceType>{urn}</serviceType>
+            <serviceId>urn:upnp-org:serviceId:{name}</serviceId>
+            <controlURL>{prefix}/{name}/control</controlURL>
+            <eventSubURL>{prefix}/{name}/event</eventSubURL>
+            <SCPDURL>{prefix}/{name}/scpd.xml</SCPDURL>
+         </service>"""
+
+DIDL_HEADER = ('<DIDL-Lite xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/" '
+               'xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:upnp="urn:schemas-upnp-org:metadata-1-0/upnp/">')
+
+SOAP_RESPONSE = """<?xml version="1.0" encoding="utf-8"?>
+<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">
+   <s:Body>
+      <u:{action}Response xmlns:u="{urn}">{fields}</u:{action}Response>
+   </s:Body>
+</s:Envelope>"""
+
+SOAP_FAULT = """<?xml version="1.0" encoding="utf-8"?>
+<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">
+   <s:Body>
+      <s:Fault>
+         <faultcode>s:Client</faultcode>
+         <faultstring>UPnPError</faultstring>
+         <detail>
+            <UPnPError xmlns="urn:schemas-upnp-org:control-1-0">
+               <errorCode>{code}</errorCode>
+               <errorDescription>{description}</errorDescription>
+            </UPnPError>
+         </detail>
+      </s:Fault>
+   </s:Body>
+</s:Envelope>"""
+
+SSDP_RESPONSE = "\r\n".join([
+   'HTTP/1.1 200 OK',
+   'CACHE-CONTROL: max-age=1800',
+   'EXT:',
+   'LOCATION: http://{host}:{port}{prefix}/description.xml',
+   'SERVER: Linux/1.0 UPnP/1.0 FakeRenderer/1.0',
+   'ST: {st}',
+   'USN: {udn}::{st}',
+   '',
+   ''])
+
+def _header(message, name):
+   found = re.findall(r'(?im)^{}:\s*(.*?)\s*$'.format(name), message)
+   return found[0] if found else ''
+
+def _field(body, tag):
+   found = re.findall('<{0}>(.*?)</{0}>'.format(tag), body, re.S)
+   return found[0] if found else ''
+
+def _escape(text):
+   return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+class UPnPFault(Exception):
+   """ Action failed, answered with UPnP error.
+   """
+
+   def __init__(self, code, description):
+      Exception.__init__(self, description)
+      self.code = code
+      self.description = description
+
+def _int_field(body, tag):
+   try:
+      return int(_field(body, tag) or 0)
+   except ValueError:
+      raise UPnPFault(402, 'Invalid args')
+
+class FakeDevice:
+   """ State of single simulated renderer.
+   """
+
+   def __init__(self, index):
+      self.index = index
+      self.name = 'Fake Renderer {}'.format(index)
+      self.udn = 'uuid:00000000-0000-0000-0000-{:012d}'.format(index)
+      self.prefix = '/dev/{}'.format(index)
+      self.uri = ''
+      self.state = 'STOPPED'
+      self.volume = 10
+      self.mute = 0
+      self.position = '00:00:00'
+      self.requests = {} # action -> number of requests received
+
+class FakeRenderer:
+   """ Simulated MediaRenderers listening on loopback.
+
+   count -- number of devices to simulate
+   latency -- seconds to wait before answering any request
+   response_size -- bytes of metadata padding added to Get*Info responses
+   library_size -- number of tracks served via ContentDirectory, 0 disables ContentDirectory
+   renderer -- serve AVTransport and RenderingControl
+   chunked -- send SOAP responses with chunked transfer encoding
+   """
+
+   def __init__(self, count = 1, latency = 0, response_size = 0, library_size = 0, host = '127.0.0.1', renderer = True, chunked = False):
+      self.host = host
+      self.latency = latency
+      self.response_size = response_size
+      self.library_size = library_size
+      self.renderer = renderer
+      self.chunked = chunked
+      self.update_id = 1 # UpdateID of all containers, increase it to simulate library change
+      self.devices = [FakeDevice(i) for i in range(count)]
+      self.ssdp_address = None
+      self.http_address = None
+      self.__udp = None
+      self.__httpd = None
+      self.__running = False
+
+   def start(self):
+      self.__udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+      self.__udp.bind((self.host, 0))
+      self.__udp.settimeout(0.2)
+      self.ssdp_address = self.__udp.getsockname()
+
+      class Handler(_SoapHandler):
+         pass
+      Handler.renderer = self
+
+      class Server(ThreadingMixIn, HTTPServer):
+         daemon_threads = True
+         request_queue_size = 128
+
+      self.__httpd = Server((self.host, 0), Handler)
+      self.http_address = self.__httpd.server_address
+
+      self.__running = True
+      for target in (self._serve_ssdp, self.__httpd.serve_forever):
+         t = threading.Thread(target=target)
+         t.daemon = True
+         t.start()
+      return self
+
+   def stop(self):
+      self.__running = False
+      self.__httpd.shutdown()
+      self.__httpd.server_close()
+      self.__udp.close()
+
+   def __enter__(self):
+      return self.start()
+
+   def __exit__(self, *args):
+      self.stop()
+
+   def services(self):
+      """ (urn, name) of services provided by every device.
+      """
+      services = []
+      if self.renderer:
+         services += [(URN_AVTransport, 'AVTransport'), (URN_RenderingControl, 'RenderingControl')]
+      if self.library_size:
+         services.append((URN_ContentDirectory, 'ContentDirectory'))
+      return services
+
+   def description(self, d):
+      """ Description xml of device.
+      """
+      services = ''.join(SERVICE.format(urn=urn, name=name, prefix=d.prefix) for urn, name in self.services())
+      device_type = 'urn:schemas-upnp-org:device:{}:1'.format('MediaRenderer' if self.renderer else 'MediaServer')
+      return DESCRIPTION.format(name=d.name, udn=d.udn, device_type=device_type, services=services)
+
+   def requests(self, action):
+      """ Number of 'action' requests received by all devices.
+      """
+      return sum(d.requests.get(action, 0) for d in self.devices)
+
+   def _serve_ssdp(self):
+      while self.__running:
+         try:
+            data, addr = self.__udp.recvfrom(4096)
+         except socket.timeout:
+            continue
+         except socket.error:
+            break
+         if not data.startswith(b'M-SEARCH'):
+            continue
+
+         st = _header(data.decode('utf-8', 'replace'), 'ST')
+         services = [urn for urn, name in self.services() if st in ('ssdp:all', urn)]
+         time.sleep(self.latency)
+         for d in self.devices:
+            for urn in services:
+               response = SSDP_RESPONSE.format(host=self.host, port=self.http_address[1], prefix=d.prefix, st=urn, udn=d.udn)
+               try:
+                  self.__udp.sendto(response.encode(), addr)
+               except socket.error:
+                  return
+
+   def device(self, path):
+      found = re.findall(r'^/dev/(\d+)/', path)
+      if not found or int(found[0]) >= len(self.devices):
+         return None
+      return self.devices[int(found[0])]
+
+   def handle_action(self, d, action, body):
+      """ Apply SOAP action to device state.
+
+      return -- response fields xml
+      """
+      d.requests[action] = d.requests.get(action, 0) + 1
+      padding = 'x' * self.response_size
+      if action == 'SetAVTransportURI':
+         d.uri = _field(body, 'CurrentURI')
+      elif action == 'Play':
+         d.state = 'PLAYING'
+      elif action == 'Pause':
+         d.state = 'PAUSED_PLAYBACK'
+      elif action == 'Stop':
+         d.state = 'STOPPED'
+      elif action == 'Seek':
+         d.position = _field(body, 'Target')
+      elif action == 'SetVolume':
+         d.volume = _int_field(body, 'DesiredVolume')
+      elif action == 'SetMute':
+         d.mute = _int_field(body, 'DesiredMute')
+      elif action == 'GetVolume':
+         return '<CurrentVolume>{}</CurrentVolume>'.format(d.volume)
+      elif action == 'GetMute':
+         return '<CurrentMute>{}</CurrentMute>'.format(d.mute)
+      elif action == 'GetTransportInfo':
+         return ('<CurrentTransportState>{}</CurrentTransportState>'
+                 '<CurrentTransportStatus>OK</CurrentTransportStatus>'
+                 '<CurrentSpeed>1</CurrentSpeed>').format(d.state)
+      elif action == 'GetMediaInfo':
+         return ('<NrTracks>1</NrTracks><MediaDuration>00:03:00</MediaDuration>'
+                 '<CurrentURI>{}</CurrentURI><CurrentURIMetaData>{}</CurrentURIMetaData>').format(d.uri, padding)
+      elif action == 'GetPositionInfo':
+         return ('<Track>1</Track><TrackDuration>00:03:00</TrackDuration><TrackMetaData>{}</TrackMetaData>'
+                 '<TrackURI>{}</TrackURI><RelTime>{}</RelTime>').format(padding, d.uri, d.position)
+      elif action in ('Browse', 'Search'):
+         return self.browse(d, body, action)
+      return ''
+
+   def _track(self, object_id):
+      """ Track number of object id like '1$<n>', None if there is no such track.
+      """
+      found = re.findall(r'^1\$(\d+)$', object_id)
+      if not found or int(found[0]) >= self.library_size:
+         return None
+      return int(found[0])
+
+   def _didl_object(self, object_id):
+      if object_id == '0':
+         return '<container id="0" parentID="-1" childCount="1"><dc:title>Root</dc:title><upnp:class>object.container</upnp:class></container>'
+      if object_id == '1':
+         return ('<container id="1" parentID="0" childCount="{}"><dc:title>Music</dc:title>'
+                 '<upnp:class>object.container.storageFolder</upnp:class></container>').format(self.library_size)
+      track = self._track(object_id)
+      return ('<item id="{0}" parentID="1" restricted="1"><dc:title>Track {1}</dc:title><upnp:artist>Artist {2}</upnp:artist>'
+              '<upnp:class>object.item.audioItem.musicTrack</upnp:class>'
+              '<res protocolInfo="http-get:*:audio/mpeg:*" duration="0:03:00">http://{3}:{4}/media/{1}</res></item>').format(
+              object_id, track, track % 100, self.host, self.http_address[1])
+
+   def browse(self, d, body, action):
+      """ Answer Browse/Search request.
+
+      return -- response fields xml
+      """
+      object_id = _field(body, 'ContainerID' if action == 'Search' else 'ObjectID')
+      if object_id not in ('0', '1') and self._track(object_id) is None:
+         raise UPnPFault(701 if action == 'Browse' else 710, 'No such object' if action == 'Browse' else 'No such container')
+      start = _int_field(body, 'StartingIndex')
+      count = _int_field(body, 'RequestedCount')
+
+      if action == 'Browse' and _field(body, 'BrowseFlag') == 'BrowseMetadata':
+         children = [object_id]
+      elif object_id == '0' and action == 'Browse':
+         children = ['1']
+      elif object_id in ('0', '1'):
+         children = ['1${}'.format(i) for i in range(self.library_size)]
+      else:
+         children = []
+
+      total = len(children)
+      page = children[start:start + count] if count else children[start:]
+      didl = DIDL_HEADER + ''.join(self._didl_object(i) for i in page) + '</DIDL-Lite>'
+      return ('<Result>{}</Result><NumberReturned>{}</NumberReturned>'
+              '<TotalMatches>{}</TotalMatches><UpdateID>{}</UpdateID>').format(_escape(didl), len(page), total, self.update_id)
+
+class _SoapHandler(BaseHTTPRequestHandler):
+   protocol_version = 'HTTP/1.1' # needed for chunked responses, every response closes connection
+   renderer = None
+
+   def log_message(self, format, *args):
+      pass
+
+   def _reply(self, code, body, content_type = 'text/xml; charset="utf-8"', chunked = False):
+      self.send_response(code)
+      self.send_header('Content-Type', content_type)
+      if chunked:
+         self.send_header('Transfer-Encoding', 'chunked')
+      else:
+         self.send_header('Content-Length', str(len(body)))
+      self.send_header('Connection', 'close')
+      self.end_headers()
+      if not chunked:
+         self.wfile.write(body)
+         return
+      for i in range(0, len(body), 1000):
+         chunk = body[i:i + 1000]
+         self.wfile.write('{:x}\r\n'.format(len(chunk)).encode() + chunk + b'\r\n')
+      self.wfile.write(b'0\r\n\r\n')
+
+   def do_GET(self):
+      time.sleep(self.renderer.latency)
+      media = re.findall(r'^/media/(\d+)', self.path)
+      if media:
+         # stream of requested size for proxy benchmarks
+         size = int(media[0])
+         self.send_response(200)
+         self.send_header('Content-Type', 'application/octet-stream')
+         self.send_header('Content-Length', str(size))
+         self.send_header('Connection', 'close')
+         self.end_headers()
+         chunk = b'\0' * (64 * 1024)
+         while size > 0:
+            self.wfile.write(chunk[:size])
+            size -= len(chunk)
+         return
+
+      d = self.renderer.device(self.path)
+      if d is None or not self.path.endswith('/description.xml'):
+         self._reply(404, b'')
+         return
+      self._reply(200, self.renderer.description(d).encode('utf-8'))
+
+   def do_POST(self):
+      time.sleep(self.renderer.latency)
+      body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+      d = self.renderer.device(self.path)
+      soap_action = re.findall(r'"?([^"#]*)#([^"]*)"?', self.headers.get('SOAPACTION', ''))
+      if d is None or not soap_action:
+         self._reply(404, b'')
+         return
+
+      urn, action = soap_action[0]
+      try:
+         fields = self.renderer.handle_action(d, action, body)
+      except UPnPFault as e:
+         self._reply(500, SOAP_FAULT.format(code=e.code, description=e.description).encode('utf-8'), chunked=self.renderer.chunked)
+         return
+      self._reply(200, SOAP_RESPONSE.format(action=action, urn=urn, fields=fields).encode('utf-8'), chunked=self.renderer.chunked)
@@ -28,28 +28,18 @@ __version__ = "0.15"
 import re
 import sys
 import time
-import signal
 import socket
 import select
 import logging
-import traceback
-import mimetypes
+import threading
+from collections import deque
 from contextlib import contextmanager
 
+# Only lightweight modules are imported here: library import must stay cheap and free of
+# side effects. Proxy, http client and CLI dependencies are imported where they are used.
 
 import os
 py3 = sys.version_info[0] == 3
-if py3:
-    from urllib.request import urlopen
-    from http.server import HTTPServer
-    from http.server import BaseHTTPRequestHandler
-else:
-    from urllib2 import urlopen
-    from BaseHTTPServer import BaseHTTPRequestHandler
-    from BaseHTTPServer import HTTPServer
-
-import shutil
-import threading
 
 SSDP_GROUP = ("239.255.255.250", 1900)
 URN_AVTransport = "urn:schemas-upnp-org:service:AVTransport:1"
@@ -58,8 +48,42 @@ URN_AVTransport_Fmt = "urn:schemas-upnp-org:service:AVTransport:{}"
 URN_RenderingControl = "urn:schemas-upnp-org:service:RenderingControl:1"
 URN_RenderingControl_Fmt = "urn:schemas-upnp-org:service:RenderingControl:{}"
 
+URN_ContentDirectory = "urn:schemas-upnp-org:service:ContentDirectory:1"
+URN_ContentDirectory_Fmt = "urn:schemas-upnp-org:service:ContentDirectory:{}"
+
 SSDP_ALL = "ssdp:all"
 
+# Control requests defaults, see DlnapDevice for per device settings
+CONNECT_TIMEOUT = 2
+READ_TIMEOUT = 5
+RETRIES = 2
+RETRY_BACKOFF = 0.2
+
+# Actions which are safe to send again if response was lost
+IDEMPOTENT_ACTIONS = ('SetAVTransportURI', 'Stop', 'Seek', 'SetVolume', 'SetMute',
+                      'GetVolume', 'GetMute', 'GetTransportInfo', 'GetMediaInfo', 'GetPositionInfo',
+                      'Browse', 'Search', 'GetSystemUpdateID')
+
+class DlnapError(Exception):
+   """ Control request to device failed.
+   """
+
+class ConnectError(DlnapError):
+   """ Device wasn't reached, request was not delivered.
+   """
+
+class DeviceUnavailable(DlnapError):
+   """ Device is known to be dead, request was not sent.
+   """
+
+class RequestTimeout(DlnapError):
+   """ Device didn't answer in time.
+   """
+
+class ConnectTimeout(ConnectError, RequestTimeout):
+   """ Device didn't accept connection in time, request was not delivered.
+   """
+
 # =================================================================================================
 # XML to DICT
 #
@@ -180,23 +204,6 @@ def _xml2dict(s, ignoreUntilXML = False):
          d[tag].append(_xml2dict(value))
    return d
 
-s = """
-   hello
-   this is a bad
-   strings
-
-   <?xml version="1.0"?>
-   <a any_tag="tag value">
-      <b><bb>value1</bb></b>
-      <b><bb>value2</bb> <v>value3</v></b>
-      </c>
-      <d>
-         <e>value4</e>
-      </d>
-      <g>value</g>
-   </a>
-"""
-
 def _xpath(d, path):
    """ Return value from xml dictionary at path.
 
@@ -224,91 +231,542 @@ def _xpath(d, path):
 #
 # XML to DICT
 # =================================================================================================
-# PROXY
+# METRICS
 #
-running = False
-class DownloadProxy(BaseHTTPRequestHandler):
+class Metrics:
+   """ Metrics sink, override methods to receive events and install it with set_metrics().
+
+   Timing events (seconds):
+      ssdp.response -- from M-SEARCH sent to device response received
+      description.fetch -- device description download
+      description.parse -- device description parsing
+      soap.request -- control request round trip, tagged with device and action
+      proxy.stream -- DownloadProxy serving single media
+   Count events:
+      description.error -- device description wasn't loaded
+      soap.error -- control request failed, tagged with device and action
+      soap.fault -- device returned UPnP fault, tagged with device and action
+      proxy.bytes -- bytes served by DownloadProxy, including partially served media
+      proxy.error -- DownloadProxy failed to serve media
+      proxy.disconnect -- device closed connection before media was served completely
+   """
 
-   def log_message(self, format, *args):
+   def timing(self, event, seconds, **tags):
       pass
 
-   def log_request(self, code='-', size='-'):
+   def count(self, event, value = 1, **tags):
       pass
 
-   def response_success(self):
-      url = self.path[1:] # replace '/'
-
-      if os.path.exists(url):
-         f = open(url)
-         content_type = mimetypes.guess_type(url)[0]
-      else:
-         f = urlopen(url=url)
+class Stats(Metrics):
+   """ Metrics sink aggregating events in memory.
+   """
 
-         if py3:
-            content_type = f.getheader("Content-Type")
+   def __init__(self):
+      self.timings = {} # (event, tags) -> [count, total, min, max]
+      self.counts = {}  # (event, tags) -> total
+      self.__lock = threading.Lock()
+
+   def timing(self, event, seconds, **tags):
+      key = (event, tuple(sorted(tags.items())))
+      with self.__lock:
+         t = self.timings.get(key)
+         if t is None:
+            self.timings[key] = [1, seconds, seconds, seconds]
          else:
-            content_type = f.info().getheaders("Content-Type")[0]
+            t[0] += 1
+            t[1] += seconds
+            t[2] = min(t[2], seconds)
+            t[3] = max(t[3], seconds)
 
-      self.send_response(200, "ok")
-      self.send_header('Access-Control-Allow-Origin', '*')
-      self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
-      self.send_header("Access-Control-Allow-Headers", "X-Requested-With")
-      self.send_header("Access-Control-Allow-Headers", "Content-Type")
-      self.send_header("Content-Type", content_type)
-      self.end_headers()
+   def count(self, event, value = 1, **tags):
+      key = (event, tuple(sorted(tags.items())))
+      with self.__lock:
+         self.counts[key] = self.counts.get(key, 0) + value
 
-   def do_OPTIONS(self):
-      self.response_success()
+   def report(self):
+      """ Format collected stats.
 
-   def do_HEAD(self):
-      self.response_success()
+      return -- multiline string
+      """
+      def name(key):
+         event, tags = key
+         return ' '.join([event] + ['{}={}'.format(k, v) for k, v in tags])
 
-   def do_GET(self):
-      global running
-      url = self.path[1:] # replace '/'
+      lines = []
+      with self.__lock:
+         for key, (n, total, lo, hi) in sorted(self.timings.items()):
+            lines.append('{}: count {} avg {:.2f} ms min {:.2f} ms max {:.2f} ms'.format(name(key), n, total / n * 1000, lo * 1000, hi * 1000))
+         for key, value in sorted(self.counts.items()):
+            lines.append('{}: {}'.format(name(key), value))
 
-      content_type = ''
-      if os.path.exists(url):
-         f = open(url)
-         content_type = mimetypes.guess_type(url)[0]
-         size = os.path.getsize(url)
-      elif not url or not url.startswith('http'):
-         self.response_success()
-         return
+         served = sum(v for (event, tags), v in self.counts.items() if event == 'proxy.bytes')
+         streamed = sum(t[1] for (event, tags), t in self.timings.items() if event == 'proxy.stream')
+         if served and streamed:
+            lines.append('proxy throughput: {:.1f} KB/s'.format(served / streamed / 1024))
+      return '\n'.join(lines)
+
+_metrics = None
+
+def set_metrics(metrics):
+   """ Install metrics sink.
+
+   metrics -- Metrics instance or None to disable metrics
+   """
+   global _metrics
+   _metrics = metrics
+
+#
+# METRICS
+# =================================================================================================
+# PROXY
+#
+running = False
+_DownloadProxy = None
+_proxy_targets = {} # token -> local file path or url DownloadProxy is allowed to serve
+_proxy_slots = {} # slot -> token of the target registered in the slot
+_proxy_lock = threading.Lock()
+
+def proxy_path(target, slot = None):
+   """ Allow download proxy to serve target.
+
+   Proxy serves registered targets only, by unguessable token, so it never exposes
+   arbitrary local files or relays arbitrary urls.
+
+   target -- local file path or http(s) url
+   slot -- key of the registration, e.g. device usn: target registered in the slot replaces
+           the previous one, so long running proxy keeps a single target per slot
+   return -- path of target on proxy, e.g. '/0f3c..9a/video.mp4'
+   """
+   if py3:
+      from urllib.parse import quote
+   else:
+      from urllib import quote
+
+   with _proxy_lock:
+      if slot is not None:
+         token = _proxy_slots.get(slot)
+         if token is not None and _proxy_targets[token] != target:
+            del _proxy_targets[token]
+            token = None
       else:
-         f = urlopen(url=url)
+         slotted = set(_proxy_slots.values())
+         token = next((t for t, v in _proxy_targets.items() if v == target and t not in slotted), None)
+      if token is None:
+         token = ''.join('{:02x}'.format(b) for b in bytearray(os.urandom(16)))
+         _proxy_targets[token] = target
+      if slot is not None:
+         _proxy_slots[slot] = token
+   name = os.path.basename(target.split('?')[0]) or 'media'
+   return '/{}/{}'.format(token, quote(name))
+
+def _urlopen(*args, **kwargs):
+   if py3:
+      from urllib.request import urlopen
+   else:
+      from urllib2 import urlopen
+   return urlopen(*args, **kwargs)
+
+def _http_server():
+   if py3:
+      from http.server import HTTPServer
+   else:
+      from BaseHTTPServer import HTTPServer
+   return HTTPServer
+
+def _proxy_handler():
+   """ Create DownloadProxy request handler class on first use.
+   """
+   global _DownloadProxy
+   if _DownloadProxy is not None:
+      return _DownloadProxy
+
+   import mimetypes
+   if py3:
+      from http.server import BaseHTTPRequestHandler
+   else:
+      from BaseHTTPServer import BaseHTTPRequestHandler
+
+   class DownloadProxy(BaseHTTPRequestHandler):
+
+      def log_message(self, format, *args):
+         pass
+
+      def log_request(self, code='-', size='-'):
+         pass
+
+      def target_url(self):
+         """ Registered target of requested path, see proxy_path().
+
+         return -- local file path or url, None if path is unknown
+         """
+         target = _proxy_targets.get(self.path.lstrip('/').split('/', 1)[0])
+         if target is None or not (target.startswith('http') or os.path.exists(target)):
+            return None
+         return target
+
+      def response_success(self):
+         url = self.target_url()
+         if url is None:
+            self.send_error(404)
+            return
+
+         if os.path.exists(url):
+            content_type = mimetypes.guess_type(url)[0] or 'application/octet-stream'
+         else:
+            f = _urlopen(url=url)
 
-      try:
-         if not content_type:
             if py3:
                content_type = f.getheader("Content-Type")
-               size = f.getheader("Content-Length")
             else:
                content_type = f.info().getheaders("Content-Type")[0]
-               size = f.info().getheaders("Content-Length")[0]
+            f.close()
 
-         self.send_response(200)
+         self.send_response(200, "ok")
          self.send_header('Access-Control-Allow-Origin', '*')
+         self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
+         self.send_header("Access-Control-Allow-Headers", "X-Requested-With")
+         self.send_header("Access-Control-Allow-Headers", "Content-Type")
          self.send_header("Content-Type", content_type)
-         self.send_header("Content-Disposition", 'attachment; filename="{}"'.format(os.path.basename(url)))
-         self.send_header("Content-Length", str(size))
          self.end_headers()
-         shutil.copyfileobj(f, self.wfile)
-      finally:
-         running = False
-         f.close()
+
+      def do_OPTIONS(self):
+         self.response_success()
+
+      def do_HEAD(self):
+         self.response_success()
+
+      def do_GET(self):
+         global running
+         url = self.target_url()
+
+         content_type = ''
+         if url is None:
+            self.send_error(404)
+            return
+         elif os.path.exists(url):
+            f = open(url, 'rb')
+            content_type = mimetypes.guess_type(url)[0] or 'application/octet-stream'
+            size = os.path.getsize(url)
+         else:
+            f = _urlopen(url=url)
+
+         start = time.time()
+         served = 0
+         try:
+            if not content_type:
+               if py3:
+                  content_type = f.getheader("Content-Type")
+                  size = f.getheader("Content-Length")
+               else:
+                  content_type = f.info().getheaders("Content-Type")[0]
+                  size = f.info().getheaders("Content-Length")[0]
+
+            self.send_response(200)
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Disposition", 'attachment; filename="{}"'.format(os.path.basename(url)))
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+
+            while True:
+               chunk = f.read(64 * 1024)
+               if not chunk:
+                  break
+               try:
+                  self.wfile.write(chunk)
+               except socket.error:
+                  # renderers drop connection on seek or stop
+                  if _metrics is not None:
+                     _metrics.count('proxy.disconnect', client=self.client_address[0])
+                  break
+               served += len(chunk)
+         except Exception:
+            if _metrics is not None:
+               _metrics.count('proxy.error', client=self.client_address[0])
+            raise
+         finally:
+            running = False
+            f.close()
+            if _metrics is not None:
+               _metrics.count('proxy.bytes', served, client=self.client_address[0])
+               _metrics.timing('proxy.stream', time.time() - start, client=self.client_address[0])
+
+   _DownloadProxy = DownloadProxy
+   return _DownloadProxy
+
+def __getattr__(name):
+   # DownloadProxy is created lazily to keep http.server out of library import
+   if name == 'DownloadProxy':
+      return _proxy_handler()
+   raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+if sys.version_info < (3, 7):
+   # module __getattr__ (PEP 562) is not supported, bind DownloadProxy at import
+   DownloadProxy = _proxy_handler()
 
 def runProxy(ip = '', port = 8000):
    global running
    running = True
+   DownloadProxy = _proxy_handler()
    DownloadProxy.protocol_version = "HTTP/1.0"
-   httpd = HTTPServer((ip, port), DownloadProxy)
+   httpd = _http_server()((ip, port), DownloadProxy)
    while running:
       httpd.handle_request()
 
+def startProxy(ip = '', port = 8000):
+   """ Start download proxy serving requests in background threads until shutdown.
+
+   ip -- ip address to listen on
+   port -- port to listen on
+   return -- http server, call its shutdown() to stop the proxy
+   """
+   if py3:
+      from socketserver import ThreadingMixIn
+   else:
+      from SocketServer import ThreadingMixIn
+
+   class ThreadingHTTPServer(ThreadingMixIn, _http_server()):
+      daemon_threads = True
+
+   DownloadProxy = _proxy_handler()
+   DownloadProxy.protocol_version = "HTTP/1.0"
+   httpd = ThreadingHTTPServer((ip, port), DownloadProxy)
+   t = threading.Thread(target=httpd.serve_forever)
+   t.daemon = True
+   t.start()
+   return httpd
+
 #
 # PROXY
 # =================================================================================================
+# COMMAND SCHEDULER
+#
+
+# Actions where only the most recent request matters: a newer value supersedes a pending one.
+COALESCABLE_ACTIONS = ('SetVolume', 'SetMute', 'Seek')
+
+class _Future:
+   """ Result of operation which may be still in progress.
+
+   Minimal subset of concurrent.futures.Future, which is not available on python 2.
+   """
+
+   def __init__(self):
+      self.__done = threading.Event()
+      self.__lock = threading.Lock()
+      self.__state = 'pending' # pending, running, cancelled or finished
+      self.__result = None
+      self.__exception = None
+
+   def cancel(self):
+      """ Cancel operation if it is not started yet.
+
+      return -- True if operation is cancelled
+      """
+      with self.__lock:
+         if self.__state == 'pending':
+            self.__state = 'cancelled'
+            self.__done.set()
+         return self.__state == 'cancelled'
+
+   def cancelled(self):
+      return self.__state == 'cancelled'
+
+   def done(self):
+      return self.__done.is_set()
+
+   def set_running_or_notify_cancel(self):
+      """ Mark operation started.
+
+      return -- False if operation was cancelled and must not run
+      """
+      with self.__lock:
+         if self.__state == 'cancelled':
+            return False
+         self.__state = 'running'
+         return True
+
+   def set_result(self, result):
+      with self.__lock:
+         self.__result = result
+         self.__state = 'finished'
+         self.__done.set()
+
+   def set_exception(self, exception):
+      with self.__lock:
+         self.__exception = exception
+         self.__state = 'finished'
+         self.__done.set()
+
+   def result(self, timeout = None):
+      """ Wait for operation to complete.
+
+      timeout -- seconds to wait, None to wait forever
+      return -- operation result
+      raise -- exception of operation, DlnapError if cancelled or timed out
+      """
+      if not self.__done.wait(timeout):
+         raise DlnapError('Operation timed out')
+      if self.__state == 'cancelled':
+         raise DlnapError('Operation cancelled')
+      if self.__exception is not None:
+         raise self.__exception
+      return self.__result
+
+class _Command:
+   """ Pending control command and the futures waiting for it.
+   """
+
+   def __init__(self, action, data, key):
+      self.action = action
+      self.data = data
+      self.key = key
+      self.futures = []
+
+class CommandScheduler:
+   """ Per-device queue of control commands executed one by one by a worker thread.
+
+   Pending SetVolume/SetMute/Seek commands are collapsed: a new request replaces a queued
+   one with the same action, instance and channel as long as no other command was queued
+   in between, so only the latest value goes to the device. Every other command is sent
+   in the order it was submitted.
+   """
+
+   def __init__(self, send):
+      """
+      send -- callable (action, data) performing the command synchronously
+      """
+      self.__send = send
+      self.__queue = deque()
+      self.__cond = threading.Condition()
+      self.__thread = None
+      self.__closed = False
+
+   def _coalesce_key(self, action, data):
+      if action not in COALESCABLE_ACTIONS:
+         return None
+      return (action, data.get('InstanceID'), data.get('Channel'))
+
+   def submit(self, action, data):
+      """ Queue command for execution.
+
+      action -- control action
+      data -- dictionary with XML fields value
+      return -- future (see _Future) completed with the result of the command actually sent to the device
+      """
+      future = _Future()
+      key = self._coalesce_key(action, data)
+      with self.__cond:
+         if self.__closed:
+            raise RuntimeError('Command scheduler is closed')
+
+         if key is not None:
+            # look back until the nearest command which must keep its order
+            for cmd in reversed(self.__queue):
+               if cmd.key is None:
+                  break
+               if cmd.key == key:
+                  cmd.data = data
+                  cmd.futures.append(future)
+                  return future
+
+         cmd = _Command(action, data, key)
+         cmd.futures.append(future)
+         self.__queue.append(cmd)
+
+         if self.__thread is None:
+            self.__thread = threading.Thread(target=self._run, name='CommandScheduler')
+            self.__thread.daemon = True
+            self.__thread.start()
+         self.__cond.notify()
+      return future
+
+   def close(self, wait=True):
+      """ Stop accepting commands; already queued ones are still sent.
+
+      wait -- block until the queue is drained
+      """
+      with self.__cond:
+         self.__closed = True
+         self.__cond.notify()
+         thread = self.__thread
+      if wait and thread is not None and thread is not threading.current_thread():
+         thread.join()
+
+   def _run(self):
+      while True:
+         with self.__cond:
+            while not self.__queue and not self.__closed:
+               self.__cond.wait()
+            if not self.__queue:
+               return
+            cmd = self.__queue.popleft()
+
+         futures = [f for f in cmd.futures if f.set_running_or_notify_cancel()]
+         if not futures:
+            continue
+
+         try:
+            result = self.__send(cmd.action, cmd.data)
+         except Exception as e:
+            for f in futures:
+               f.set_exception(e)
+         else:
+            for f in futures:
+               f.set_result(result)
+
+#
+# COMMAND SCHEDULER
+# =================================================================================================
+# CIRCUIT BREAKER
+#
+class CircuitBreaker:
+   """ Fail fast on device which stopped responding.
+
+   After 'threshold' failed requests in a row the breaker opens and rejects requests
+   for 'reset_timeout' seconds. Then a single trial request is let through: success
+   closes the breaker, failure opens it again.
+   """
+
+   def __init__(self, threshold = 3, reset_timeout = 30):
+      self.threshold = threshold
+      self.reset_timeout = reset_timeout
+      self.__failures = 0
+      self.__opened_at = None
+      self.__trial = False
+      self.__lock = threading.Lock()
+
+   @property
+   def is_open(self):
+      return self.__opened_at is not None
+
+   def allow(self):
+      """ Check if request may be sent.
+      """
+      with self.__lock:
+         if self.__opened_at is None:
+            return True
+         if self.__trial or time.time() - self.__opened_at < self.reset_timeout:
+            return False
+         self.__trial = True
+         return True
+
+   def record_success(self):
+      with self.__lock:
+         self.__failures = 0
+         self.__opened_at = None
+         self.__trial = False
+
+   def record_failure(self):
+      with self.__lock:
+         self.__failures += 1
+         self.__trial = False
+         if self.__failures >= self.threshold:
+            self.__opened_at = time.time()
+
+#
+# CIRCUIT BREAKER
+# =================================================================================================
 
 def _get_port(location):
    """ Extract port number from url.
@@ -316,7 +774,7 @@ def _get_port(location):
    location -- string like http://anyurl:port/whatever/path
    return -- port number
    """
-   port = re.findall('http://.*?:(\d+).*', location)
+   port = re.findall(r'http://.*?:(\d+).*', location)
    return int(port[0]) if port else 80
 
 
@@ -340,37 +798,127 @@ def _send_udp(to, packet):
    yield sock
    sock.close()
 
+def _escape_xml(text):
+   """ Escape xml special symbols in text value.
+   """
+   return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
 def _unescape_xml(xml):
    """ Replace escaped xml symbols with real ones.
    """
    return xml.replace('&lt;', '<').replace('&gt;', '>').replace('&quot;', '"')
 
-def _send_tcp(to, payload):
+def _dechunk(body):
+   """ Decode body of HTTP response with chunked transfer encoding.
+
+   body -- raw body bytes
+   return -- decoded body or None if body is incomplete or malformed
+   """
+   decoded = bytearray()
+   i = 0
+   while True:
+      line_end = body.find(b'\r\n', i)
+      if line_end < 0:
+         return None
+      try:
+         size = int(bytes(body[i:line_end]).split(b';')[0].strip(), 16)
+      except ValueError:
+         return None
+      if size == 0:
+         return bytes(decoded) # trailers are ignored
+      start = line_end + 2
+      if len(body) < start + size + 2:
+         return None
+      decoded += body[start:start + size]
+      i = start + size + 2
+
+def _recv_response(sock, timeout):
+   """ Receive HTTP response until it's complete or connection is closed by device.
+
+   Chunked response is returned with decoded body.
+
+   sock -- connected socket
+   timeout -- seconds to wait for the whole response
+   return -- raw response bytes
+   """
+   deadline = time.time() + timeout
+   data = bytearray()
+   length = None
+   header_end = -1
+   chunked = False
+   body = None
+   while True:
+      remaining = deadline - time.time()
+      if remaining <= 0:
+         raise socket.timeout('timed out')
+      sock.settimeout(remaining)
+      chunk = sock.recv(4096)
+      if not chunk:
+         break
+      data += chunk
+
+      if length is None:
+         header_end = data.find(b'\r\n\r\n')
+         if header_end >= 0:
+            headers = data[:header_end]
+            chunked = re.search(b'(?im)^transfer-encoding:[^\r\n]*chunked', headers) is not None
+            found = re.findall(b'(?im)^content-length:\\s*(\\d+)', headers)
+            length = header_end + 4 + int(found[0]) if found and not chunked else -1
+      if chunked and data.endswith(b'\r\n\r\n'): # last chunk or trailers end with empty line
+         body = _dechunk(data[header_end + 4:])
+         if body is not None:
+            break
+      elif length is not None and length >= 0 and len(data) >= length:
+         break
+
+   if chunked and body is not None:
+      return bytes(data[:header_end + 4]) + body
+   return bytes(data)
+
+def _send_tcp(to, payload, connect_timeout = CONNECT_TIMEOUT, read_timeout = READ_TIMEOUT, raw = False):
    """ Send TCP message to group
 
    to -- (host, port) group to send to payload to
    payload -- message to send
+   connect_timeout -- seconds to wait for connection to be established
+   read_timeout -- seconds to wait for the whole response
+   raw -- return response as is instead of parsing it
+   return -- response xml dictionary or raw response string
+   raise -- ConnectError if device wasn't reached, RequestTimeout if it didn't respond in time,
+            DlnapError if request failed otherwise or response is malformed
    """
    try:
-      sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-      sock.settimeout(5)
-      sock.connect(to)
+      sock = socket.create_connection(to, connect_timeout)
+   except socket.timeout as e:
+      raise ConnectTimeout('Unable to connect to {}:{}: {}'.format(to[0], to[1], e))
+   except socket.error as e:
+      raise ConnectError('Unable to connect to {}:{}: {}'.format(to[0], to[1], e))
+
+   try:
       sock.sendall(payload.encode('utf-8'))
+      data = _recv_response(sock, read_timeout)
+   except socket.timeout as e:
+      raise RequestTimeout('No response from {}:{}: {}'.format(to[0], to[1], e))
+   except socket.error as e:
+      raise DlnapError('No response from {}:{}: {}'.format(to[0], to[1], e))
+   finally:
+      sock.close()
 
-      data = sock.recv(2048)
+   try:
       if py3:
          data = data.decode('utf-8')
+      else:
+         data.decode('utf-8') # keep str, but reject malformed response as python 3 does
+      if raw:
+         return data
       data = _xml2dict(_unescape_xml(data), True)
-
-      errorDescription = _xpath(data, 's:Envelope/s:Body/s:Fault/detail/UPnPError/errorDescription')
-      if errorDescription is not None:
-         logging.error(errorDescription)
    except Exception as e:
-      data = ''
-   finally:
-      sock.close()
-   return data
+      raise DlnapError('Malformed response from {}:{}: {}'.format(to[0], to[1], e))
 
+   errorDescription = _xpath(data, 's:Envelope/s:Body/s:Fault/detail/UPnPError/errorDescription')
+   if errorDescription is not None:
+      logging.error(errorDescription)
+   return data
 
 def _get_location_url(raw):
     """ Extract device description url from discovery response
@@ -378,11 +926,20 @@ def _get_location_url(raw):
     raw -- raw discovery response
     return -- location url string
     """
-    t = re.findall('\n(?i)location:\s*(.*)\r\s*', raw, re.M)
+    t = re.findall(r'(?i)\nlocation:\s*(.*)\r\s*', raw, re.M)
     if len(t) > 0:
         return t[0]
     return ''
 
+def _get_usn(raw):
+   """ Extract unique device name from discovery response
+
+   raw -- raw discovery response
+   return -- device part of USN, e.g. 'uuid:device-UUID' of 'uuid:device-UUID::urn:...', or empty string
+   """
+   t = re.findall(r'(?i)\nusn:\s*(.*)\r\s*', raw, re.M)
+   return t[0].split('::')[0].strip() if t else ''
+
 def _get_friendly_name(xml):
    """ Extract device name from description xml
 
@@ -404,62 +961,112 @@ def _get_serve_ip(target_ip, target_port=80):
     s.close()
     return my_ip
 
-class DlnapDevice:
+_device_logger = logging.getLogger('DlnapDevice')
+
+class DlnapDevice(object):
    """ Represents DLNA/UPnP device.
+
+   Only fields required to control device are kept, full description is loaded on demand
+   via 'description'. Devices are equal and hashed by USN so they can be kept in sets and dicts.
    """
 
+   __slots__ = ('ip', 'ssdp_version', 'usn', 'location', 'port', 'name',
+                'control_url', 'rendering_control_url', 'content_directory_url',
+                'scheduler', 'connect_timeout', 'read_timeout', 'retries', 'retry_backoff', 'breaker')
+
    def __init__(self, raw, ip):
-      self.__logger = logging.getLogger(self.__class__.__name__)
-      self.__logger.info('=> New DlnapDevice (ip = {}) initialization..'.format(ip))
+      _device_logger.info('=> New DlnapDevice (ip = %s) initialization..', ip)
 
       self.ip = ip
       self.ssdp_version = 1
 
+      self.usn = None
+      self.location = ''
       self.port = None
       self.name = 'Unknown'
       self.control_url = None
       self.rendering_control_url = None
-      self.has_av_transport = False
+      self.content_directory_url = None
+      self.scheduler = None
+
+      self.connect_timeout = CONNECT_TIMEOUT
+      self.read_timeout = READ_TIMEOUT
+      self.retries = RETRIES
+      self.retry_backoff = RETRY_BACKOFF
+      self.breaker = None # created on first request
 
       try:
-         self.__raw = raw.decode()
-         self.location = _get_location_url(self.__raw)
-         self.__logger.info('location: {}'.format(self.location))
+         raw = raw.decode()
+         self.location = _get_location_url(raw)
+         _device_logger.info('location: %s', self.location)
+
+         self.usn = _get_usn(raw) or self.location
+         _device_logger.info('usn: %s', self.usn)
 
          self.port = _get_port(self.location)
-         self.__logger.info('port: {}'.format(self.port))
+         _device_logger.info('port: %s', self.port)
 
-         raw_desc_xml = urlopen(self.location).read().decode()
+         desc_xml = self._load_description()
 
-         self.__desc_xml = _xml2dict(raw_desc_xml)
-         self.__logger.debug('description xml: {}'.format(self.__desc_xml))
+         self.name = _get_friendly_name(desc_xml)
+         _device_logger.info('friendlyName: %s', self.name)
 
-         self.name = _get_friendly_name(self.__desc_xml)
-         self.__logger.info('friendlyName: {}'.format(self.name))
+         self.control_url = _get_control_url(desc_xml, URN_AVTransport)
+         _device_logger.info('control_url: %s', self.control_url)
 
-         self.control_url = _get_control_url(self.__desc_xml, URN_AVTransport)
-         self.__logger.info('control_url: {}'.format(self.control_url))
+         self.rendering_control_url = _get_control_url(desc_xml, URN_RenderingControl)
+         _device_logger.info('rendering_control_url: %s', self.rendering_control_url)
 
-         self.rendering_control_url = _get_control_url(self.__desc_xml, URN_RenderingControl)
-         self.__logger.info('rendering_control_url: {}'.format(self.rendering_control_url))
+         self.content_directory_url = _get_control_url(desc_xml, URN_ContentDirectory)
+         _device_logger.info('content_directory_url: %s', self.content_directory_url)
 
-         self.has_av_transport = self.control_url is not None
-         self.__logger.info('=> Initialization completed'.format(ip))
+         _device_logger.info('=> Initialization completed')
       except Exception as e:
-         self.__logger.warning('DlnapDevice (ip = {}) init exception:\n{}'.format(ip, traceback.format_exc()))
+         if _metrics is not None:
+            _metrics.count('description.error', device=ip)
+         _device_logger.warning('DlnapDevice (ip = %s) init exception:', ip, exc_info=True)
 
    def __repr__(self):
       return '{} @ {}'.format(self.name, self.ip)
 
    def __eq__(self, d):
-      return self.name == d.name and self.ip == d.ip
+      return isinstance(d, DlnapDevice) and self.usn == d.usn
+
+   def __ne__(self, d):
+      return not self == d
+
+   def __hash__(self):
+      return hash(self.usn)
+
+   @property
+   def has_av_transport(self):
+      return self.control_url is not None
+
+   @property
+   def description(self):
+      """ Device description xml dictionary, loaded from device on every access.
+      """
+      return self._load_description()
+
+   def _load_description(self):
+      start = time.time()
+      raw_desc_xml = _urlopen(self.location, timeout=self.read_timeout).read().decode()
+      if _metrics is not None:
+         _metrics.timing('description.fetch', time.time() - start, device=self.ip)
+
+      start = time.time()
+      desc_xml = _xml2dict(raw_desc_xml)
+      if _metrics is not None:
+         _metrics.timing('description.parse', time.time() - start, device=self.ip)
+      _device_logger.debug('description xml: %s', desc_xml)
+      return desc_xml
 
    def _payload_from_template(self, action, data, urn):
-      """ Assembly payload from template.
+      """ Assembly payload from template, field values are xml escaped.
       """
       fields = ''
       for tag, value in data.items():
-        fields += '<{tag}>{value}</{tag}>'.format(tag=tag, value=value)
+        fields += '<{tag}>{value}</{tag}>'.format(tag=tag, value=_escape_xml('{}'.format(value)))
 
       payload = """<?xml version="1.0" encoding="utf-8"?>
          <s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">
@@ -480,6 +1087,9 @@ class DlnapDevice:
       if action in ["SetVolume", "SetMute", "GetVolume"]:
           url = self.rendering_control_url
           urn = URN_RenderingControl_Fmt.format(self.ssdp_version)
+      elif action in ["Browse", "Search", "GetSystemUpdateID"]:
+          url = self.content_directory_url
+          urn = URN_ContentDirectory_Fmt.format(self.ssdp_version)
       else:
           url = self.control_url
           urn = URN_AVTransport_Fmt.format(self.ssdp_version)
@@ -498,49 +1108,121 @@ class DlnapDevice:
          payload,
          ])
 
-      self.__logger.debug(packet)
+      _device_logger.debug('%s', packet)
       return packet
 
+   def _send_now(self, action, data, raw = False):
+      """ Send control action to device and wait for response.
+
+      Request which failed fast (e.g. connection refused or reset) is retried with exponential
+      backoff if it wasn't delivered or action is idempotent. Timed out request is not retried:
+      device which doesn't answer would otherwise hold the caller for several timeouts.
+
+      action -- control action
+      data -- dictionary with XML fields value
+      raw -- return response as is instead of parsing it
+      return -- response xml dictionary or raw response string
+      raise -- DeviceUnavailable if circuit breaker is open, DlnapError if request failed
+      """
+      if self.breaker is None:
+         self.breaker = CircuitBreaker()
+      if not self.breaker.allow():
+         raise DeviceUnavailable('{} is not responding'.format(self))
+
+      packet = self._create_packet(action, data)
+      succeeded = False
+      try:
+         attempt = 0
+         while True:
+            start = time.time()
+            try:
+               result = _send_tcp((self.ip, self.port), packet, self.connect_timeout, self.read_timeout, raw)
+            except DlnapError as e:
+               if _metrics is not None:
+                  _metrics.count('soap.error', device=self.ip, action=action)
+               retry = not isinstance(e, RequestTimeout) and (isinstance(e, ConnectError) or action in IDEMPOTENT_ACTIONS)
+               if not retry or attempt >= self.retries:
+                  raise
+               _device_logger.info('%s failed, retrying: %s', action, e)
+               time.sleep(self.retry_backoff * 2 ** attempt)
+               attempt += 1
+            else:
+               if _metrics is not None:
+                  _metrics.timing('soap.request', time.time() - start, device=self.ip, action=action)
+                  if (':Fault>' in result) if raw else (_xpath(result, 's:Envelope/s:Body/s:Fault') is not None):
+                     _metrics.count('soap.fault', device=self.ip, action=action)
+               succeeded = True
+               return result
+      finally:
+         # any outcome, even unexpected exception, must close half-open breaker trial
+         if succeeded:
+            self.breaker.record_success()
+         else:
+            self.breaker.record_failure()
+
+   def _send(self, action, data):
+      """ Send control action to device directly or via command scheduler if it's started.
+
+      return -- response xml dictionary or future of it when scheduler is used
+      """
+      if self.scheduler is not None:
+         return self.scheduler.submit(action, data)
+      return self._send_now(action, data)
+
+   def start_scheduler(self):
+      """ Send further commands asynchronously via CommandScheduler.
+
+      Control methods return futures afterwards; rapid volume/mute/seek changes are coalesced.
+      return -- command scheduler
+      """
+      if self.scheduler is None:
+         self.scheduler = CommandScheduler(self._send_now)
+      return self.scheduler
+
+   def stop_scheduler(self, wait=True):
+      """ Go back to synchronous commands.
+
+      wait -- block until already queued commands are sent
+      """
+      scheduler, self.scheduler = self.scheduler, None
+      if scheduler is not None:
+         scheduler.close(wait)
+
    def set_current_media(self, url, instance_id = 0):
       """ Set media to playback.
 
       url -- media url
       instance_id -- device instance id
       """
-      packet = self._create_packet('SetAVTransportURI', {'InstanceID':instance_id, 'CurrentURI':url, 'CurrentURIMetaData':'' })
-      _send_tcp((self.ip, self.port), packet)
+      return self._send('SetAVTransportURI', {'InstanceID':instance_id, 'CurrentURI':url, 'CurrentURIMetaData':'' })
 
    def play(self, instance_id = 0):
       """ Play media that was already set as current.
 
       instance_id -- device instance id
       """
-      packet = self._create_packet('Play', {'InstanceID': instance_id, 'Speed': 1})
-      _send_tcp((self.ip, self.port), packet)
+      return self._send('Play', {'InstanceID': instance_id, 'Speed': 1})
 
    def pause(self, instance_id = 0):
       """ Pause media that is currently playing back.
 
       instance_id -- device instance id
       """
-      packet = self._create_packet('Pause', {'InstanceID': instance_id, 'Speed':1})
-      _send_tcp((self.ip, self.port), packet)
+      return self._send('Pause', {'InstanceID': instance_id, 'Speed':1})
 
    def stop(self, instance_id = 0):
       """ Stop media that is currently playing back.
 
       instance_id -- device instance id
       """
-      packet = self._create_packet('Stop', {'InstanceID': instance_id, 'Speed': 1})
-      _send_tcp((self.ip, self.port), packet)
+      return self._send('Stop', {'InstanceID': instance_id, 'Speed': 1})
 
 
    def seek(self, position, instance_id = 0):
       """
       Seek position
       """
-      packet = self._create_packet('Seek', {'InstanceID':instance_id, 'Unit':'REL_TIME', 'Target': position })
-      _send_tcp((self.ip, self.port), packet)
+      return self._send('Seek', {'InstanceID':instance_id, 'Unit':'REL_TIME', 'Target': position })
 
 
    def volume(self, volume=10, instance_id = 0):
@@ -548,17 +1230,14 @@ class DlnapDevice:
 
       instance_id -- device instance id
       """
-      packet = self._create_packet('SetVolume', {'InstanceID': instance_id, 'DesiredVolume': volume, 'Channel': 'Master'})
-
-      _send_tcp((self.ip, self.port), packet)
+      return self._send('SetVolume', {'InstanceID': instance_id, 'DesiredVolume': volume, 'Channel': 'Master'})
       
       
    def get_volume(self, instance_id = 0):
       """
       get volume
       """
-      packet = self._create_packet('GetVolume', {'InstanceID':instance_id, 'Channel': 'Master'})
-      _send_tcp((self.ip, self.port), packet)
+      return self._send('GetVolume', {'InstanceID':instance_id, 'Channel': 'Master'})
 
 
    def mute(self, instance_id = 0):
@@ -566,40 +1245,35 @@ class DlnapDevice:
 
       instance_id -- device instance id
       """
-      packet = self._create_packet('SetMute', {'InstanceID': instance_id, 'DesiredMute': '1', 'Channel': 'Master'})
-      _send_tcp((self.ip, self.port), packet)
+      return self._send('SetMute', {'InstanceID': instance_id, 'DesiredMute': '1', 'Channel': 'Master'})
 
    def unmute(self, instance_id = 0):
       """ Stop media that is currently playing back.
 
       instance_id -- device instance id
       """
-      packet = self._create_packet('SetMute', {'InstanceID': instance_id, 'DesiredMute': '0', 'Channel': 'Master'})
-      _send_tcp((self.ip, self.port), packet)
+      return self._send('SetMute', {'InstanceID': instance_id, 'DesiredMute': '0', 'Channel': 'Master'})
 
    def info(self, instance_id=0):
       """ Transport info.
 
       instance_id -- device instance id
       """
-      packet = self._create_packet('GetTransportInfo', {'InstanceID': instance_id})
-      return _send_tcp((self.ip, self.port), packet)
+      return self._send('GetTransportInfo', {'InstanceID': instance_id})
 
    def media_info(self, instance_id=0):
       """ Media info.
 
       instance_id -- device instance id
       """
-      packet = self._create_packet('GetMediaInfo', {'InstanceID': instance_id})
-      return _send_tcp((self.ip, self.port), packet)
+      return self._send('GetMediaInfo', {'InstanceID': instance_id})
 
 
    def position_info(self, instance_id=0):
       """ Position info.
       instance_id -- device instance id
       """
-      packet = self._create_packet('GetPositionInfo', {'InstanceID': instance_id})
-      return _send_tcp((self.ip, self.port), packet)
+      return self._send('GetPositionInfo', {'InstanceID': instance_id})
 
 
    def set_next(self, url):
@@ -609,20 +1283,25 @@ class DlnapDevice:
       pass
 
 
-def discover(name = '', ip = '', timeout = 1, st = SSDP_ALL, mx = 3, ssdp_version = 1):
+def discover(name = '', ip = '', timeout = 1, st = SSDP_ALL, mx = 3, ssdp_version = 1, group = SSDP_GROUP, capable = None):
    """ Discover UPnP devices in the local network.
 
    name -- name or part of the name to filter devices
    timeout -- timeout to perform discover
    st -- st field of discovery packet
    mx -- mx field of discovery packet
+   group -- (host, port) to send discovery packet to, multicast SSDP group by default
+   capable -- callable(DlnapDevice) checking that device provides required service, discovery
+              by ip stops at the first capable device; device with AVTransport by default
    return -- list of DlnapDevice
    """
+   if capable is None:
+      capable = lambda d: d.has_av_transport
    st = st.format(ssdp_version)
    payload = "\r\n".join([
               'M-SEARCH * HTTP/1.1',
               'User-Agent: {}/{}'.format(__file__, __version__),
-              'HOST: {}:{}'.format(*SSDP_GROUP),
+              'HOST: {}:{}'.format(*group),
               'Accept: */*',
               'MAN: "ssdp:discover"',
               'ST: {}'.format(st),
@@ -630,36 +1309,634 @@ def discover(name = '', ip = '', timeout = 1, st = SSDP_ALL, mx = 3, ssdp_versio
               '',
               ''])
    devices = []
-   with _send_udp(SSDP_GROUP, payload) as sock:
+   seen = set() # USNs of already responded devices, each device responds once per service
+   responses = deque() # (data, addr) received but not processed yet
+   with _send_udp(group, payload) as sock:
       start = time.time()
+
+      def receive():
+         # read every pending response before description of the next device is fetched,
+         # so ssdp.response isn't delayed by processing of earlier responses
+         while select.select([sock], [], [], 0)[0]:
+            data, addr = sock.recvfrom(4096)
+            if _metrics is not None:
+               _metrics.timing('ssdp.response', time.time() - start, device=addr[0])
+            responses.append((data, addr))
+
       while True:
          if time.time() - start > timeout:
             # timed out
             break
-         r, w, x = select.select([sock], [], [sock], 1)
-         if sock in r:
-             data, addr = sock.recvfrom(1024)
-             if ip and addr[0] != ip:
-                continue
-
-             d = DlnapDevice(data, addr[0])
-             d.ssdp_version = ssdp_version
-             if d not in devices:
-                if not name or name is None or name.lower() in d.name.lower():
-                   if not ip:
-                      devices.append(d)
-                   elif d.has_av_transport:
-                      # no need in further searching by ip
-                      devices.append(d)
-                      break
-
-         elif sock in x:
-             raise Exception('Getting response failed')
-         else:
-             # Nothing to read
-             pass
+         if not responses:
+            r, w, x = select.select([sock], [], [sock], 1)
+            if sock in x:
+               raise Exception('Getting response failed')
+            if sock not in r:
+               # Nothing to read
+               continue
+         receive()
+
+         data, addr = responses.popleft()
+         if ip and addr[0] != ip:
+            continue
+
+         # skip description download for devices which already responded
+         raw = data.decode('utf-8', 'replace')
+         usn = _get_usn(raw) or _get_location_url(raw)
+         if usn in seen:
+            continue
+         seen.add(usn)
+
+         d = DlnapDevice(data, addr[0])
+         d.ssdp_version = ssdp_version
+         if not name or name is None or name.lower() in d.name.lower():
+            if not ip:
+               devices.append(d)
+            elif capable(d):
+               # no need in further searching by ip
+               devices.append(d)
+               break
    return devices
 
+# =================================================================================================
+# CONTENT DIRECTORY
+#
+def _local_name(tag):
+   """ Strip namespace from ElementTree tag name.
+   """
+   return tag.rsplit('}', 1)[-1]
+
+def _didl_objects(didl):
+   """ Parse DIDL-Lite document.
+
+   didl -- DIDL-Lite xml string
+   return -- list of object dictionaries like
+      {'id': '64$1', 'parent_id': '64', 'container': False, 'title': 'Song', 'class': 'object.item.audioItem.musicTrack',
+       'artist': 'Band', 'res': [{'url': 'http://...', 'protocolInfo': 'http-get:*:audio/mpeg:*', 'duration': '0:03:10'}]}
+      Other DIDL-Lite properties are added by their names without namespace.
+   """
+   from xml.etree import ElementTree
+
+   objects = []
+   for e in ElementTree.fromstring(didl.encode('utf-8')):
+      obj = {'id': e.get('id'), 'parent_id': e.get('parentID'), 'container': _local_name(e.tag) == 'container', 'res': []}
+      if obj['container']:
+         obj['child_count'] = e.get('childCount')
+      for p in e:
+         name = _local_name(p.tag)
+         if name == 'res':
+            res = dict(p.attrib)
+            res['url'] = (p.text or '').strip()
+            obj['res'].append(res)
+         elif name not in obj:
+            obj[name] = (p.text or '').strip()
+      objects.append(obj)
+   return objects
+
+def _browse_response(response):
+   """ Parse raw Browse/Search response.
+
+   response -- raw http response
+   return -- (objects, number returned, total matches, update id)
+   raise -- DlnapError if device returned fault or malformed response
+   """
+   from xml.etree import ElementTree
+
+   body = response.split('\r\n\r\n', 1)[-1]
+   fields = {}
+   try:
+      for e in ElementTree.fromstring(body.encode('utf-8')).iter():
+         name = _local_name(e.tag)
+         if name in ('Result', 'NumberReturned', 'TotalMatches', 'UpdateID', 'errorCode', 'errorDescription'):
+            fields[name] = (e.text or '').strip()
+
+      if 'errorCode' in fields:
+         raise DlnapError('UPnP error {}: {}'.format(fields['errorCode'], fields.get('errorDescription', '')))
+
+      objects = _didl_objects(fields['Result']) if fields.get('Result') else []
+      return (objects, int(fields.get('NumberReturned') or len(objects)),
+              int(fields.get('TotalMatches') or 0), fields.get('UpdateID'))
+   except (ElementTree.ParseError, KeyError, ValueError) as e:
+      raise DlnapError('Malformed Browse/Search response: {}'.format(e))
+
+class ContentDirectory:
+   """ Client of MediaServer ContentDirectory service.
+
+   Browse and Search results are requested page by page and yielded one object at a time,
+   so memory doesn't grow with container size. Optional page cache is validated by the
+   container UpdateID: cached pages are used only while the container wasn't changed.
+
+   e.g.
+      server = discover(name='nas', st=URN_ContentDirectory_Fmt)[0]
+      for obj in ContentDirectory(server).browse('0'):
+         print(obj['title'])
+   """
+
+   def __init__(self, device, page_size = 100, cache_size = 0):
+      """
+      device -- DlnapDevice with ContentDirectory service
+      page_size -- number of objects requested at once
+      cache_size -- number of pages to cache, 0 disables cache
+      """
+      if device.content_directory_url is None:
+         raise DlnapError('{} has no ContentDirectory service'.format(device))
+      self.device = device
+      self.page_size = page_size
+      self.cache_size = cache_size
+      self.__cache = None
+      self.__lock = threading.Lock()
+      if cache_size:
+         from collections import OrderedDict
+         self.__cache = OrderedDict() # (action, args, start) -> (update id, page)
+
+   def _request(self, action, data):
+      return _browse_response(self.device._send_now(action, data, raw=True))
+
+   def _cached(self, key, update_id):
+      with self.__lock:
+         entry = self.__cache.get(key)
+         if entry is None:
+            return None
+         if entry[0] != update_id:
+            del self.__cache[key]
+            return None
+         self.__cache.pop(key)
+         self.__cache[key] = entry # most recently used goes last
+         return entry[1]
+
+   def _store(self, key, update_id, page):
+      with self.__lock:
+         self.__cache[key] = (update_id, page)
+         while len(self.__cache) > self.cache_size:
+            self.__cache.popitem(last=False)
+
+   def _pages(self, action, args, container_id):
+      """ Yield objects of all result pages.
+
+      action -- Browse or Search
+      args -- request fields except StartingIndex and RequestedCount
+      container_id -- container UpdateID of which validates cached pages
+      """
+      update_id = None
+      if self.__cache is not None:
+         update_id = self.update_id(container_id)
+
+      start = 0
+      while True:
+         key = (action, tuple(sorted(args.items())), start, self.page_size)
+         page = self._cached(key, update_id) if update_id is not None else None
+         if page is None:
+            data = dict(args, StartingIndex=start, RequestedCount=self.page_size)
+            objects, returned, total, page_update_id = self._request(action, data)
+            page = (objects, returned, total)
+            if self.__cache is not None and page_update_id is not None:
+               if update_id is not None and page_update_id != update_id:
+                  logging.info('Container %s changed while paging', container_id)
+               update_id = page_update_id
+               self._store(key, update_id, page)
+
+         objects, returned, total = page
+         for obj in objects:
+            yield obj
+
+         start += returned
+         if not returned or (total and start >= total) or (not total and returned < self.page_size):
+            break
+
+   def update_id(self, object_id = '0'):
+      """ Current UpdateID of container.
+      """
+      data = {'ObjectID': object_id, 'BrowseFlag': 'BrowseMetadata', 'Filter': '*',
+              'StartingIndex': 0, 'RequestedCount': 1, 'SortCriteria': ''}
+      return self._request('Browse', data)[3]
+
+   def metadata(self, object_id = '0'):
+      """ Object metadata.
+
+      return -- object dictionary or None if it wasn't found
+      """
+      data = {'ObjectID': object_id, 'BrowseFlag': 'BrowseMetadata', 'Filter': '*',
+              'StartingIndex': 0, 'RequestedCount': 1, 'SortCriteria': ''}
+      objects = self._request('Browse', data)[0]
+      return objects[0] if objects else None
+
+   def browse(self, object_id = '0', filter = '*', sort = ''):
+      """ Iterate over direct children of container.
+
+      object_id -- container id, '0' is root
+      filter -- comma separated properties to return, '*' for all
+      sort -- sort criteria like '+dc:title'
+      return -- generator of object dictionaries, see _didl_objects
+      """
+      args = {'ObjectID': object_id, 'BrowseFlag': 'BrowseDirectChildren',
+              'Filter': filter, 'SortCriteria': sort}
+      return self._pages('Browse', args, object_id)
+
+   def search(self, criteria = '*', container_id = '0', filter = '*', sort = ''):
+      """ Iterate over objects matching search criteria.
+
+      criteria -- search criteria like 'upnp:class derivedfrom "object.item.audioItem"'
+      container_id -- container to search in
+      filter -- comma separated properties to return, '*' for all
+      sort -- sort criteria like '+dc:title'
+      return -- generator of object dictionaries, see _didl_objects
+      """
+      args = {'ContainerID': container_id, 'SearchCriteria': criteria,
+              'Filter': filter, 'SortCriteria': sort}
+      return self._pages('Search', args, container_id)
+
+#
+# CONTENT DIRECTORY
+# =================================================================================================
+# URL RESOLVER
+#
+RESOLVED_URL_TTL = 3600
+RESOLVE_TIMEOUT = 30
+
+def _is_youtube(url):
+   """ Check if url is YouTube page url.
+   """
+   host = url.lower().replace('https://', '').replace('http://', '').replace('www.', '').replace('m.youtube.', 'youtube.')
+   return host.startswith('youtube.') or host.startswith('youtu.be/')
+
+def _youtube_dl(url, timeout = RESOLVE_TIMEOUT):
+   """ Resolve page url into media stream url with youtube-dl.
+
+   timeout -- seconds to wait for youtube-dl, it is killed afterwards
+   raise -- DlnapError if youtube-dl is not available, failed or timed out
+   """
+   import subprocess
+   try:
+      # best single file format: it has both video and audio, unlike separate best video and audio streams
+      process = subprocess.Popen(['youtube-dl', '-f', 'best', '-g', url], stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+   except OSError as e:
+      raise DlnapError('Unable to run youtube-dl: {}'.format(e))
+
+   # communicate() has no timeout on python 2
+   timed_out = []
+   def kill():
+      timed_out.append(True)
+      try:
+         process.kill()
+      except OSError:
+         pass # already exited
+   killer = threading.Timer(timeout, kill)
+   killer.daemon = True
+   killer.start()
+   try:
+      out, err = process.communicate()
+   finally:
+      killer.cancel()
+   if timed_out:
+      raise DlnapError('youtube-dl timed out after {} s'.format(timeout))
+   urls = out.decode('utf-8').split()
+   if process.returncode != 0 or not urls:
+      raise DlnapError('youtube-dl failed: {}'.format(err.decode('utf-8', 'replace').strip()))
+   return urls[0]
+
+class UrlResolver:
+   """ Resolves page urls (e.g. YouTube) into media urls playable by devices.
+
+   Resolved urls are cached by source url until 'ttl' expires or the stream url's own
+   'expire' parameter is reached, whichever comes first. Concurrent requests for the
+   same url share single resolution unless it takes longer than 'timeout': then it is
+   considered hung and the next request starts a new one.
+   """
+
+   def __init__(self, ttl = RESOLVED_URL_TTL, timeout = RESOLVE_TIMEOUT):
+      self.ttl = ttl
+      self.timeout = timeout
+      self.resolvers = [(_is_youtube, lambda url: _youtube_dl(url, self.timeout))] # (match(url), resolve(url)) pairs
+      self.__cache = {}   # source url -> (expiration time, resolved url)
+      self.__pending = {} # source url -> (start time, future) of resolution in progress
+      self.__lock = threading.Lock()
+
+   def add(self, match, resolve):
+      """ Register resolver, it takes precedence over already registered ones.
+
+      match -- callable(url) returning True if url is handled by the resolver
+      resolve -- callable(url) returning media url, blocking is ok
+      """
+      self.resolvers.insert(0, (match, resolve))
+
+   def _expiration(self, resolved):
+      expires = time.time() + self.ttl
+      found = re.findall(r'[?&/]expire[=/](\d+)', resolved)
+      if found:
+         # leave some time to start playback before stream url expires
+         expires = min(expires, int(found[0]) - 60)
+      return expires
+
+   def resolve_async(self, url):
+      """ Start resolving url in background.
+
+      return -- future (see _Future) of media url; url itself if no resolver matches it
+      """
+      future = _Future()
+      with self.__lock:
+         cached = self.__cache.get(url)
+         if cached is not None and cached[0] > time.time():
+            future.set_result(cached[1])
+            return future
+         pending = self.__pending.get(url)
+         if pending is not None and time.time() - pending[0] < self.timeout:
+            return pending[1]
+
+         resolve = None
+         for match, r in self.resolvers:
+            if match(url):
+               resolve = r
+               break
+         if resolve is None:
+            future.set_result(url)
+            return future
+         self.__pending[url] = (time.time(), future)
+
+      def done():
+         # newer resolution may have replaced this one if it was considered hung
+         if self.__pending.get(url, (0, None))[1] is future:
+            del self.__pending[url]
+
+      def run():
+         try:
+            resolved = resolve(url)
+         except Exception as e:
+            with self.__lock:
+               done()
+            future.set_exception(e)
+            return
+
+         now = time.time()
+         with self.__lock:
+            for u in [u for u, c in self.__cache.items() if c[0] <= now]:
+               del self.__cache[u]
+            self.__cache[url] = (self._expiration(resolved), resolved)
+            done()
+         future.set_result(resolved)
+
+      t = threading.Thread(target=run, name='UrlResolver')
+      t.daemon = True
+      t.start()
+      return future
+
+   def resolve(self, url):
+      """ Resolve url into media url, blocks until resolved.
+
+      raise -- resolver exception, DlnapError if resolution took longer than 'timeout'
+      """
+      return self.resolve_async(url).result(self.timeout)
+
+#
+# URL RESOLVER
+# =================================================================================================
+# CONTROL DAEMON
+#
+DAEMON_SOCKET = os.path.join(os.environ.get('XDG_RUNTIME_DIR', '/tmp'), 'dlnap.sock')
+
+class ControlDaemon:
+   """ Keeps discovered devices and download proxy warm and executes commands
+   received over a local unix socket.
+
+   Protocol is JSON lines: each request is an object like
+      {"action": "volume", "device": "tv", "ip": "", "volume": 20}
+   answered by {"ok": true, "result": ...} or {"ok": false, "error": "..."}.
+   Actions: list, discover, stats, play, pause, stop, volume, seek, mute, unmute, info, media-info, browse.
+   """
+
+   def __init__(self, socket_path = DAEMON_SOCKET, timeout = 1, ssdp_version = 1, proxy_port = 8000, group = SSDP_GROUP):
+      self.socket_path = socket_path
+      self.timeout = timeout
+      self.ssdp_version = ssdp_version
+      self.proxy_port = proxy_port
+      self.group = group
+      self.devices = {} # usn -> DlnapDevice
+      self.resolver = UrlResolver()
+      self.__directories = {} # usn -> ContentDirectory keeping browsed pages
+      self.__proxies = {} # interface ip -> download proxy
+      self.__server = None
+      self.__lock = threading.Lock()
+
+   def discover(self, name = '', ip = '', st = URN_AVTransport_Fmt, capable = None):
+      """ Discover devices and refresh the known ones.
+
+      Rediscovered device replaces the known device with the same USN, which may have got
+      another address meanwhile; the replaced device stops its command scheduler.
+
+      st -- st field of discovery packet
+      capable -- see discover()
+      return -- list of found DlnapDevice
+      """
+      found = discover(name=name, ip=ip, timeout=self.timeout, st=st, ssdp_version=self.ssdp_version,
+                       group=self.group, capable=capable)
+      with self.__lock:
+         for d in found:
+            stale = self.devices.get(d.usn)
+            if stale is not None:
+               stale.stop_scheduler(wait=False)
+               self.__directories.pop(d.usn, None)
+            d.start_scheduler()
+            self.devices[d.usn] = d
+      return found
+
+   def device(self, name = '', ip = '', st = URN_AVTransport_Fmt, capable = None):
+      """ Find known device by name or ip, discover it if it is not known yet or not responding.
+
+      st, capable -- see discover()
+      """
+      if capable is None:
+         capable = lambda d: d.has_av_transport
+      with self.__lock:
+         for d in self.devices.values():
+            if ip and d.ip != ip:
+               continue
+            if name and name.lower() not in d.name.lower():
+               continue
+            if not capable(d) or (d.breaker is not None and d.breaker.is_open):
+               continue
+            return d
+
+      found = [d for d in self.discover(name, ip, st, capable) if capable(d)]
+      if not found:
+         raise DlnapError('No compatible devices found.')
+      with self.__lock:
+         return self.devices[found[0].usn]
+
+   def directory(self, d):
+      """ ContentDirectory of media server caching browsed pages between commands.
+      """
+      with self.__lock:
+         if d.usn not in self.__directories:
+            self.__directories[d.usn] = ContentDirectory(d, cache_size=64)
+         return self.__directories[d.usn]
+
+   def proxy_url(self, d, url):
+      """ Wrap url into download proxy url reachable by device.
+
+      Proxy listens on the interface facing the device only and serves the url last
+      played via proxy on each device.
+      """
+      ip = _get_serve_ip(d.ip)
+      with self.__lock:
+         if ip not in self.__proxies:
+            self.__proxies[ip] = startProxy(ip, self.proxy_port)
+      return 'http://{}:{}{}'.format(ip, self.proxy_port, proxy_path(url, slot=d.usn))
+
+   def handle(self, request):
+      """ Execute single command.
+
+      Command failing to reach the device is retried once on the rediscovered device:
+      device may have got a new address since it was discovered.
+
+      request -- command dictionary
+      return -- command result
+      """
+      action = request.get('action', 'list')
+      if action == 'list':
+         devices = list(self.devices.values()) or self.discover()
+         return [{'name': d.name, 'ip': d.ip, 'av_transport': d.has_av_transport} for d in devices]
+      if action == 'discover':
+         return [{'name': d.name, 'ip': d.ip, 'av_transport': d.has_av_transport} for d in self.discover()]
+      if action == 'stats':
+         return _metrics.report() if isinstance(_metrics, Stats) else ''
+      if action not in ('play', 'pause', 'stop', 'volume', 'seek', 'mute', 'unmute', 'info', 'media-info', 'browse'):
+         raise DlnapError('Unknown action: {}'.format(action))
+
+      resolved = None
+      if action == 'play':
+         # resolve while device is being looked up
+         resolved = self.resolver.resolve_async(request.get('url', ''))
+
+      name, ip = request.get('device', ''), request.get('ip', '')
+      st, capable = URN_AVTransport_Fmt, None
+      if action == 'browse':
+         st, capable = URN_ContentDirectory_Fmt, lambda d: d.content_directory_url is not None
+
+      d = self.device(name, ip, st, capable)
+      try:
+         return self._execute(d, action, request, resolved)
+      except (ConnectError, DeviceUnavailable) as e:
+         logging.info('%s is unreachable, rediscovering: %s', d, e)
+         if d.usn not in [f.usn for f in self.discover(name, ip, st, capable)]:
+            raise
+         with self.__lock:
+            d = self.devices[d.usn]
+         return self._execute(d, action, request, resolved)
+
+   def _execute(self, d, action, request, resolved):
+      def wait(result):
+         # device replaced by rediscovery meanwhile has no scheduler and answers synchronously
+         return result.result() if isinstance(result, _Future) else result
+
+      if action == 'play':
+         url = resolved.result(self.resolver.timeout)
+         if request.get('proxy') or url.lower().startswith('https://'):
+            url = self.proxy_url(d, url)
+         wait(d.stop())
+         wait(d.set_current_media(url=url))
+         return wait(d.play())
+      elif action == 'pause':
+         return wait(d.pause())
+      elif action == 'stop':
+         return wait(d.stop())
+      elif action == 'volume':
+         return wait(d.volume(request.get('volume', 10)))
+      elif action == 'seek':
+         return wait(d.seek(request.get('position', '00:00:00')))
+      elif action == 'mute':
+         return wait(d.mute())
+      elif action == 'unmute':
+         return wait(d.unmute())
+      elif action == 'info':
+         return wait(d.info())
+      elif action == 'media-info':
+         return wait(d.media_info())
+      elif action == 'browse':
+         return list(self.directory(d).browse(request.get('object_id', '0')))
+
+   def serve_forever(self):
+      """ Listen for commands on the unix socket until interrupted or shut down.
+      """
+      import json
+      if py3:
+         import socketserver
+      else:
+         import SocketServer as socketserver
+
+      daemon = self
+      class Handler(socketserver.StreamRequestHandler):
+         def handle(self):
+            for line in self.rfile:
+               try:
+                  response = {'ok': True, 'result': daemon.handle(json.loads(line.decode('utf-8')))}
+               except Exception as e:
+                  logging.warning('Command failed:', exc_info=True)
+                  response = {'ok': False, 'error': str(e)}
+               self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+               self.wfile.flush()
+
+      class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+         daemon_threads = True
+
+      if os.path.exists(self.socket_path):
+         try:
+            send_command({'action': 'list'}, self.socket_path)
+         except (socket.error, DlnapError):
+            os.remove(self.socket_path) # stale socket of crashed daemon
+         else:
+            raise DlnapError('Daemon is already running at {}'.format(self.socket_path))
+
+      server = self.__server = Server(self.socket_path, Handler)
+      try:
+         server.serve_forever()
+      finally:
+         server.server_close()
+         os.remove(self.socket_path)
+         for proxy in self.__proxies.values():
+            proxy.shutdown()
+            proxy.server_close()
+         for d in self.devices.values():
+            d.stop_scheduler(wait=False)
+
+   def shutdown(self):
+      """ Stop serve_forever() running in another thread.
+      """
+      if self.__server is not None:
+         self.__server.shutdown()
+
+def send_command(request, socket_path = DAEMON_SOCKET, timeout = 30):
+   """ Send command to ControlDaemon.
+
+   request -- command dictionary, see ControlDaemon
+   socket_path -- daemon unix socket
+   return -- command result
+   raise -- DlnapError if daemon failed to execute command
+   """
+   import json
+   sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+   sock.settimeout(timeout)
+   try:
+      sock.connect(socket_path)
+      sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+      data = b''
+      while not data.endswith(b'\n'):
+         chunk = sock.recv(4096)
+         if not chunk:
+            break
+         data += chunk
+   finally:
+      sock.close()
+
+   if not data:
+      raise DlnapError('No response from daemon')
+   response = json.loads(data.decode('utf-8'))
+   if not response['ok']:
+      raise DlnapError(response['error'])
+   return response['result']
+
+#
+# CONTROL DAEMON
+# =================================================================================================
+
 #
 # Signal of Ctrl+C
 # =================================================================================================
@@ -667,10 +1944,12 @@ def signal_handler(signal, frame):
    print(' Got Ctrl + C, exit now!')
    sys.exit(1)
 
-signal.signal(signal.SIGINT, signal_handler)
-
 if __name__ == '__main__':
    import getopt
+   import signal
+   import traceback
+
+   signal.signal(signal.SIGINT, signal_handler)
 
    def usage():
       print('{} [--ip <device ip>] [-d[evice] <name>] [--all] [-t[imeout] <seconds>] [--play <url>] [--pause] [--stop] [--proxy]'.format(__file__))
@@ -684,15 +1963,25 @@ if __name__ == '__main__':
       print(' --unmute - unmute playback')
       print(' --volume <vol> - set current volume for playback')
       print(' --seek <position in HH:MM:SS> - set current position for playback')
+      print(' --browse <object id> - list content of media server container, root container id is 0')
       print(' --timeout <seconds> - discover timeout')
       print(' --ssdp-version <version> - discover devices by protocol version, default 1')
       print(' --proxy - use local proxy on proxy port')
       print(' --proxy-port <port number> - proxy port to listen incomming connections from devices, default 8000')
+      print(' --daemon - keep devices and proxy warm and execute commands received over control socket')
+      print(' --client - send command to running daemon instead of discovering devices')
+      print(' --socket <path> - daemon control socket, default {}'.format(DAEMON_SOCKET))
+      print(' --stats - print timings and counters on exit, or request them from daemon with --client')
       print(' --help - this help')
 
    def version():
       print(__version__)
 
+   def format_object(obj):
+      if obj['container']:
+         return ' [c] {} {}'.format(obj['id'], obj.get('title', ''))
+      return ' [i] {} {} {}'.format(obj['id'], obj.get('title', ''), obj['res'][0]['url'] if obj['res'] else '')
+
    try:
       opts, args = getopt.getopt(sys.argv[1:], "hvd:t:i:", [   # information arguments
                                                                'help',
@@ -711,6 +2000,7 @@ if __name__ == '__main__':
                                                                'mute',
                                                                'unmute',
                                                                'seek=',
+                                                               'browse=',
 
 
                                                                # discover arguments
@@ -725,7 +2015,15 @@ if __name__ == '__main__':
 
                                                                # download proxy
                                                                'proxy',
-                                                               'proxy-port='])
+                                                               'proxy-port=',
+
+                                                               # control daemon
+                                                               'daemon',
+                                                               'client',
+                                                               'socket=',
+
+                                                               # instrumentation
+                                                               'stats'])
    except getopt.GetoptError:
       usage()
       sys.exit(1)
@@ -734,6 +2032,7 @@ if __name__ == '__main__':
    url = ''
    vol = 10
    position = '00:00:00'
+   object_id = '0'
    timeout = 1
    action = ''
    logLevel = logging.WARN
@@ -742,6 +2041,10 @@ if __name__ == '__main__':
    proxy = False
    proxy_port = 8000
    ssdp_version = 1
+   daemon = False
+   client = False
+   socket_path = DAEMON_SOCKET
+   stats = False
    for opt, arg in opts:
       if opt in ('-h', '--help'):
          usage()
@@ -783,6 +2086,9 @@ if __name__ == '__main__':
       elif opt in ('--seek'):
          action = 'seek'
          position = arg
+      elif opt in ('--browse'):
+         action = 'browse'
+         object_id = arg
       elif opt in ('--mute'):
          action = 'mute'
       elif opt in ('--unmute'):
@@ -795,15 +2101,84 @@ if __name__ == '__main__':
          proxy = True
       elif opt in ('--proxy-port'):
          proxy_port = int(arg)
+      elif opt in ('--daemon'):
+         daemon = True
+      elif opt in ('--client'):
+         client = True
+      elif opt in ('--socket'):
+         socket_path = arg
+      elif opt in ('--stats'):
+         stats = True
 
    logging.basicConfig(level=logLevel)
 
-   st = URN_AVTransport_Fmt if compatibleOnly else SSDP_ALL
-   allDevices = discover(name=device, ip=ip, timeout=timeout, st=st, ssdp_version=ssdp_version)
+   if stats and not client:
+      import atexit
+      def print_stats():
+         print('Stats:')
+         print(_metrics.report())
+
+      set_metrics(Stats())
+      atexit.register(print_stats)
+
+   if daemon:
+      signal.signal(signal.SIGTERM, signal_handler)
+      d = ControlDaemon(socket_path, timeout=timeout, ssdp_version=ssdp_version, proxy_port=proxy_port)
+      d.discover()
+      d.serve_forever()
+      sys.exit(0)
+
+   if client:
+      if os.path.exists(url):
+         url = os.path.abspath(url) # daemon proxy serves files by absolute path
+      request = {'action': action or ('stats' if stats else 'list'), 'device': device, 'ip': ip, 'url': url,
+                 'volume': vol, 'position': position, 'proxy': proxy, 'object_id': object_id}
+      try:
+         result = send_command(request, socket_path)
+      except (socket.error, DlnapError) as e:
+         print('Daemon is unable to {}: {}'.format(request['action'], e))
+         sys.exit(1)
+
+      if request['action'] == 'list':
+         print('Discovered devices:')
+         for d in result:
+            print(' {} {} @ {}'.format('[a]' if d['av_transport'] else '[x]', d['name'], d['ip']))
+      elif request['action'] == 'browse':
+         for obj in result:
+            print(format_object(obj))
+      elif request['action'] in ('info', 'media-info', 'stats'):
+         print(result)
+      sys.exit(0)
+
+   # resolve page url (e.g. YouTube) into media url while devices are being discovered
+   resolver = UrlResolver()
+   resolved = resolver.resolve_async(url) if action == 'play' else None
+
+   if action == 'browse':
+      st = URN_ContentDirectory_Fmt if compatibleOnly else SSDP_ALL
+   else:
+      st = URN_AVTransport_Fmt if compatibleOnly else SSDP_ALL
+   capable = (lambda d: d.content_directory_url is not None) if action == 'browse' else None
+   allDevices = discover(name=device, ip=ip, timeout=timeout, st=st, ssdp_version=ssdp_version, capable=capable)
    if not allDevices:
       print('No compatible devices found.')
       sys.exit(1)
 
+   if action == 'browse':
+      servers = [d for d in allDevices if d.content_directory_url is not None]
+      if not servers:
+         print('No media servers found.')
+         sys.exit(1)
+
+      print(servers[0])
+      try:
+         for obj in ContentDirectory(servers[0]).browse(object_id):
+            print(format_object(obj))
+      except DlnapError as e:
+         print('Server is unable to browse: {}'.format(e))
+         sys.exit(1)
+      sys.exit(0)
+
    if action in ('', 'list'):
       print('Discovered devices:')
       for d in allDevices:
@@ -813,10 +2188,12 @@ if __name__ == '__main__':
    d = allDevices[0]
    print(d)
 
-   if url.lower().replace('https://', '').replace('www.', '').startswith('youtube.'):
-      import subprocess
-      process = subprocess.Popen(['youtube-dl', '-g', url], stdout = subprocess.PIPE)
-      url, err = process.communicate()
+   if resolved is not None:
+      try:
+         url = resolved.result(resolver.timeout)
+      except DlnapError as e:
+         print('Unable to resolve {}: {}'.format(url, e))
+         sys.exit(1)
 
    if url.lower().startswith('https://'):
       proxy = True
@@ -831,29 +2208,34 @@ if __name__ == '__main__':
    if action == 'play':
       try:
          d.stop()
-         url = 'http://{}:{}/{}'.format(ip, proxy_port, url) if proxy else url
+         url = 'http://{}:{}{}'.format(ip, proxy_port, proxy_path(url)) if proxy else url
          d.set_current_media(url=url)
          d.play()
       except Exception as e:
          print('Device is unable to play media.')
          logging.warn('Play exception:\n{}'.format(traceback.format_exc()))
          sys.exit(1)
-   elif action == 'pause':
-      d.pause()
-   elif action == 'stop':
-      d.stop()
-   elif action == 'volume':
-      d.volume(vol)
-   elif action == 'seek':
-      d.seek(position)
-   elif action == 'mute':
-      d.mute()
-   elif action == 'unmute':
-      d.unmute()
-   elif action == 'info':
-      print(d.info())
-   elif action == 'media-info':
-      print(d.media_info())
+
+   try:
+      if action == 'pause':
+         d.pause()
+      elif action == 'stop':
+         d.stop()
+      elif action == 'volume':
+         d.volume(vol)
+      elif action == 'seek':
+         d.seek(position)
+      elif action == 'mute':
+         d.mute()
+      elif action == 'unmute':
+         d.unmute()
+      elif action == 'info':
+         print(d.info())
+      elif action == 'media-info':
+         print(d.media_info())
+   except DlnapError as e:
+      print('Device is unable to {}: {}'.format(action, e))
+      sys.exit(1)
 
    if proxy:
       while running:
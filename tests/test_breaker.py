@@ -0,0 +1,198 @@
+#!/usr/bin/python
+
+# @file test_breaker.py
+# @brief CircuitBreaker state machine and control request retry tests.
+
+import os
+import sys
+import time
+import socket
+import logging
+import threading
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'dlnap'))
+sys.path.insert(0, os.path.join(HERE, '..', 'benchmarks'))
+
+import dlnap
+from fake_renderer import FakeRenderer, SOAP_RESPONSE
+
+OK_RESPONSE = SOAP_RESPONSE.format(action='GetTransportInfo', urn=dlnap.URN_AVTransport,
+                                   fields='<CurrentTransportState>STOPPED</CurrentTransportState>')
+OK_REPLY = 'HTTP/1.1 200 OK\r\nContent-Length: {}\r\n\r\n{}'.format(len(OK_RESPONSE), OK_RESPONSE).encode('utf-8')
+BAD_REPLY = b'HTTP/1.1 200 OK\r\nContent-Length: 4\r\n\r\n\xff\xfe\xfd\xfc'
+
+class ScriptedDevice:
+   """ TCP server answering n-th connection with n-th reply of the script.
+
+   Reply None keeps connection open without answering; the last reply repeats.
+   """
+
+   def __init__(self, replies):
+      self.replies = list(replies)
+      self.connections = 0
+      self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+      self.sock.bind(('127.0.0.1', 0))
+      self.sock.listen(8)
+      self.port = self.sock.getsockname()[1]
+      self.__open = []
+      t = threading.Thread(target=self._serve)
+      t.daemon = True
+      t.start()
+
+   def _serve(self):
+      while True:
+         try:
+            conn, addr = self.sock.accept()
+         except socket.error:
+            return
+         reply = self.replies[min(self.connections, len(self.replies) - 1)]
+         self.connections += 1
+         conn.recv(65536)
+         if reply is None:
+            self.__open.append(conn)
+            continue
+         conn.sendall(reply)
+         conn.close()
+
+   def close(self):
+      self.sock.close()
+      for conn in self.__open:
+         conn.close()
+
+class ErrorCounter(dlnap.Metrics):
+   def __init__(self):
+      self.errors = 0
+
+   def count(self, event, value = 1, **tags):
+      if event == 'soap.error':
+         self.errors += value
+
+class CircuitBreakerTest(unittest.TestCase):
+
+   def test_opens_after_threshold_failures(self):
+      breaker = dlnap.CircuitBreaker(threshold=3, reset_timeout=30)
+      for i in range(2):
+         breaker.record_failure()
+         self.assertTrue(breaker.allow())
+      breaker.record_failure()
+      self.assertTrue(breaker.is_open)
+      self.assertFalse(breaker.allow())
+
+   def test_success_resets_failure_count(self):
+      breaker = dlnap.CircuitBreaker(threshold=2)
+      breaker.record_failure()
+      breaker.record_success()
+      breaker.record_failure()
+      self.assertFalse(breaker.is_open)
+
+   def test_half_open_lets_single_trial_through(self):
+      breaker = dlnap.CircuitBreaker(threshold=1, reset_timeout=0.05)
+      breaker.record_failure()
+      self.assertFalse(breaker.allow())
+      time.sleep(0.1)
+      self.assertTrue(breaker.allow())
+      self.assertFalse(breaker.allow()) # trial is in progress
+
+   def test_successful_trial_closes(self):
+      breaker = dlnap.CircuitBreaker(threshold=1, reset_timeout=0.05)
+      breaker.record_failure()
+      time.sleep(0.1)
+      self.assertTrue(breaker.allow())
+      breaker.record_success()
+      self.assertFalse(breaker.is_open)
+      self.assertTrue(breaker.allow())
+      self.assertTrue(breaker.allow())
+
+   def test_failed_trial_opens_again(self):
+      breaker = dlnap.CircuitBreaker(threshold=1, reset_timeout=0.05)
+      breaker.record_failure()
+      time.sleep(0.1)
+      self.assertTrue(breaker.allow())
+      breaker.record_failure()
+      self.assertFalse(breaker.allow())
+      time.sleep(0.1)
+      self.assertTrue(breaker.allow())
+
+class ControlRequestTest(unittest.TestCase):
+
+   @classmethod
+   def setUpClass(cls):
+      logging.disable(logging.CRITICAL)
+      with FakeRenderer() as renderer:
+         cls.template = dlnap.discover(timeout=0.2, st=dlnap.URN_AVTransport_Fmt, group=renderer.ssdp_address)[0]
+
+   @classmethod
+   def tearDownClass(cls):
+      logging.disable(logging.NOTSET)
+
+   def setUp(self):
+      self.device = None
+      self.counter = ErrorCounter()
+      dlnap.set_metrics(self.counter)
+
+   def tearDown(self):
+      dlnap.set_metrics(None)
+      if self.device is not None:
+         self.device.close()
+
+   def renderer(self, replies, threshold = 1, reset_timeout = 0.05):
+      """ Device controlled over scripted connection replies.
+      """
+      self.device = ScriptedDevice(replies)
+      d = self.template
+      d.port = self.device.port
+      d.read_timeout = 0.2
+      d.retry_backoff = 0.01
+      d.breaker = dlnap.CircuitBreaker(threshold, reset_timeout)
+      return d
+
+   def test_malformed_reply_raises_dlnap_error(self):
+      d = self.renderer([BAD_REPLY], threshold=10)
+      d.retries = 0
+      self.assertRaises(dlnap.DlnapError, d.info)
+
+   def test_malformed_reply_during_trial_doesnt_lock_breaker(self):
+      d = self.renderer([OK_REPLY, BAD_REPLY, BAD_REPLY, OK_REPLY])
+      d.retries = 0
+      d.info()
+      d.breaker.record_failure() # open
+      time.sleep(0.1)
+      self.assertRaises(dlnap.DlnapError, d.info) # failed trial
+      self.assertRaises(dlnap.DeviceUnavailable, d.info)
+      time.sleep(0.1)
+      self.assertRaises(dlnap.DlnapError, d.info) # failed trial again
+      time.sleep(0.1)
+      self.assertIn('STOPPED', str(d.info()))
+      self.assertFalse(d.breaker.is_open)
+
+   def test_timed_out_request_is_not_retried(self):
+      d = self.renderer([None], threshold=10)
+      d.retries = 2
+      start = time.time()
+      self.assertRaises(dlnap.RequestTimeout, d.info)
+      self.assertLess(time.time() - start, 0.5)
+      self.assertEqual(self.device.connections, 1)
+
+   def test_refused_connection_is_retried(self):
+      d = self.renderer([OK_REPLY], threshold=10)
+      d.retries = 2
+      self.device.close()
+      self.assertRaises(dlnap.ConnectError, d.play)
+      self.assertEqual(self.counter.errors, 3)
+
+   def test_failed_idempotent_request_is_retried(self):
+      d = self.renderer([BAD_REPLY, OK_REPLY], threshold=10)
+      d.retries = 2
+      self.assertIn('STOPPED', str(d.info()))
+      self.assertEqual(self.device.connections, 2)
+
+   def test_failed_non_idempotent_request_is_not_retried(self):
+      d = self.renderer([BAD_REPLY, OK_REPLY], threshold=10)
+      d.retries = 2
+      self.assertRaises(dlnap.DlnapError, d.play)
+      self.assertEqual(self.device.connections, 1)
+
+if __name__ == '__main__':
+   unittest.main()
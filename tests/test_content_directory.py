@@ -0,0 +1,160 @@
+#!/usr/bin/python
+
+# @file test_content_directory.py
+# @brief ContentDirectory paging, page cache and error mapping tests.
+
+import os
+import sys
+import time
+import logging
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'dlnap'))
+sys.path.insert(0, os.path.join(HERE, '..', 'benchmarks'))
+
+import dlnap
+from fake_renderer import FakeRenderer
+
+def media_server(renderer):
+   return dlnap.discover(timeout=0.2, st=dlnap.URN_ContentDirectory_Fmt, group=renderer.ssdp_address)[0]
+
+class ContentDirectoryTest(unittest.TestCase):
+
+   @classmethod
+   def setUpClass(cls):
+      logging.disable(logging.CRITICAL)
+      cls.renderer = FakeRenderer(library_size=250, renderer=False).start()
+      cls.server = media_server(cls.renderer)
+
+   @classmethod
+   def tearDownClass(cls):
+      cls.renderer.stop()
+      logging.disable(logging.NOTSET)
+
+   def setUp(self):
+      self.renderer.library_size = 250
+      self.renderer.chunked = False
+      self.start_browses = self.browses()
+
+   def browses(self):
+      return self.renderer.requests('Browse')
+
+   def test_browse_pages_through_container(self):
+      objects = list(dlnap.ContentDirectory(self.server, page_size=100).browse('1'))
+      self.assertEqual([o['id'] for o in objects], ['1${}'.format(i) for i in range(250)])
+      self.assertEqual(objects[7]['title'], 'Track 7')
+      self.assertTrue(objects[7]['res'][0]['url'].endswith('/media/7'))
+      self.assertEqual(self.browses() - self.start_browses, 3)
+
+   def test_browse_stops_at_total_matches(self):
+      self.renderer.library_size = 200
+      self.assertEqual(len(list(dlnap.ContentDirectory(self.server, page_size=100).browse('1'))), 200)
+      self.assertEqual(self.browses() - self.start_browses, 2)
+
+   def test_browse_root(self):
+      objects = list(dlnap.ContentDirectory(self.server).browse('0'))
+      self.assertEqual(len(objects), 1)
+      self.assertTrue(objects[0]['container'])
+      self.assertEqual(objects[0]['child_count'], '250')
+
+   def test_search(self):
+      objects = list(dlnap.ContentDirectory(self.server, page_size=100).search('upnp:class derivedfrom "object.item"', '1'))
+      self.assertEqual(len(objects), 250)
+
+   def test_metadata(self):
+      self.assertEqual(dlnap.ContentDirectory(self.server).metadata('1$3')['title'], 'Track 3')
+
+   def test_cached_pages_are_reused(self):
+      cd = dlnap.ContentDirectory(self.server, page_size=100, cache_size=10)
+      list(cd.browse('1'))
+      before = self.browses()
+      self.assertEqual(len(list(cd.browse('1'))), 250)
+      self.assertEqual(self.browses() - before, 1) # UpdateID check only
+
+   def test_cache_is_invalidated_by_update_id(self):
+      cd = dlnap.ContentDirectory(self.server, page_size=100, cache_size=10)
+      list(cd.browse('1'))
+      self.renderer.update_id += 1
+      before = self.browses()
+      self.assertEqual(len(list(cd.browse('1'))), 250)
+      self.assertEqual(self.browses() - before, 4) # UpdateID check and all pages again
+
+   def test_cache_size_is_bounded(self):
+      cd = dlnap.ContentDirectory(self.server, page_size=100, cache_size=2)
+      list(cd.browse('1'))
+      before = self.browses()
+      list(cd.browse('1'))
+      # the first page was evicted by the later ones, then it evicts the second one and so on
+      self.assertEqual(self.browses() - before, 4)
+
+   def test_fault_raises_dlnap_error(self):
+      cd = dlnap.ContentDirectory(self.server)
+      self.assertRaises(dlnap.DlnapError, list, cd.browse('no such container'))
+      self.assertRaises(dlnap.DlnapError, cd.metadata, '1$999')
+
+   def test_chunked_responses(self):
+      self.renderer.chunked = True
+      objects = list(dlnap.ContentDirectory(self.server, page_size=100).browse('1'))
+      self.assertEqual(len(objects), 250)
+
+   def test_discover_media_server_by_ip(self):
+      start = time.time()
+      servers = dlnap.discover(ip='127.0.0.1', timeout=3, group=self.renderer.ssdp_address,
+                               capable=lambda d: d.content_directory_url is not None)
+      self.assertEqual(len(servers), 1)
+      self.assertLess(time.time() - start, 1.5)
+
+class PagingTest(unittest.TestCase):
+   """ Stop conditions of paging against scripted pages.
+   """
+
+   class Server:
+      content_directory_url = '/cd'
+
+   def browse(self, pages, page_size = 2):
+      """ Browse container answered with pages of (object ids, total matches).
+      """
+      cd = dlnap.ContentDirectory(self.Server(), page_size=page_size)
+      requests = []
+      def request(action, data):
+         requests.append(data['StartingIndex'])
+         ids, total = pages[len(requests) - 1]
+         return ([{'id': i} for i in ids], len(ids), total, '1')
+      cd._request = request
+      return [o['id'] for o in cd.browse('1')], requests
+
+   def test_unknown_total_stops_at_short_page(self):
+      ids, requests = self.browse([(['a', 'b'], 0), (['c'], 0)])
+      self.assertEqual(ids, ['a', 'b', 'c'])
+      self.assertEqual(requests, [0, 2])
+
+   def test_unknown_total_stops_at_empty_page(self):
+      ids, requests = self.browse([(['a', 'b'], 0), ([], 0)])
+      self.assertEqual(ids, ['a', 'b'])
+      self.assertEqual(requests, [0, 2])
+
+   def test_empty_page_stops_despite_larger_total(self):
+      ids, requests = self.browse([(['a', 'b'], 10), ([], 10)])
+      self.assertEqual(ids, ['a', 'b'])
+      self.assertEqual(requests, [0, 2])
+
+   def test_server_returning_less_than_page_continues_to_total(self):
+      ids, requests = self.browse([(['a'], 3), (['b'], 3), (['c'], 3)])
+      self.assertEqual(ids, ['a', 'b', 'c'])
+      self.assertEqual(requests, [0, 1, 2])
+
+class BrowseResponseTest(unittest.TestCase):
+
+   def test_malformed_responses_raise_dlnap_error(self):
+      for response in ('', 'HTTP/1.1 404 Not Found\r\n\r\n<html><body>Not found',
+                       'HTTP/1.1 200 OK\r\n\r\n<r><NumberReturned>x</NumberReturned></r>'):
+         self.assertRaises(dlnap.DlnapError, dlnap._browse_response, response)
+
+   def test_dechunk(self):
+      self.assertEqual(dlnap._dechunk(b'3\r\nabc\r\n2;ext=1\r\nde\r\n0\r\n\r\n'), b'abcde')
+      self.assertEqual(dlnap._dechunk(b'3\r\nabc\r\n'), None)
+      self.assertEqual(dlnap._dechunk(b'x\r\n'), None)
+
+if __name__ == '__main__':
+   unittest.main()
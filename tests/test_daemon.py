@@ -0,0 +1,173 @@
+#!/usr/bin/python
+
+# @file test_daemon.py
+# @brief ControlDaemon JSON lines protocol, registry refresh and proxy registration tests.
+
+import os
+import sys
+import time
+import shutil
+import socket
+import logging
+import tempfile
+import threading
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'dlnap'))
+sys.path.insert(0, os.path.join(HERE, '..', 'benchmarks'))
+
+import dlnap
+from fake_renderer import FakeRenderer
+
+def free_port():
+   sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+   sock.bind(('127.0.0.1', 0))
+   port = sock.getsockname()[1]
+   sock.close()
+   return port
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'daemon listens on unix socket')
+class DaemonProtocolTest(unittest.TestCase):
+
+   @classmethod
+   def setUpClass(cls):
+      logging.disable(logging.CRITICAL)
+      cls.renderer = FakeRenderer(count=2, library_size=5).start()
+      cls.tmp = tempfile.mkdtemp()
+      cls.socket_path = os.path.join(cls.tmp, 'dlnap.sock')
+      cls.daemon = dlnap.ControlDaemon(cls.socket_path, timeout=0.2, proxy_port=free_port(), group=cls.renderer.ssdp_address)
+      cls.thread = threading.Thread(target=cls.daemon.serve_forever)
+      cls.thread.daemon = True
+      cls.thread.start()
+      for i in range(100):
+         if os.path.exists(cls.socket_path):
+            break
+         time.sleep(0.05)
+
+   @classmethod
+   def tearDownClass(cls):
+      cls.daemon.shutdown()
+      cls.thread.join(5)
+      cls.renderer.stop()
+      shutil.rmtree(cls.tmp)
+      logging.disable(logging.NOTSET)
+
+   def command(self, action, **kwargs):
+      kwargs['action'] = action
+      return dlnap.send_command(kwargs, self.socket_path, timeout=10)
+
+   def test_discover_and_list(self):
+      names = ['Fake Renderer 0', 'Fake Renderer 1']
+      self.assertEqual(sorted(d['name'] for d in self.command('discover')), names)
+      devices = self.command('list')
+      self.assertEqual(sorted(d['name'] for d in devices), names)
+      self.assertTrue(all(d['av_transport'] for d in devices))
+
+   def test_volume(self):
+      self.command('volume', device='Renderer 1', volume=20)
+      self.assertEqual(self.renderer.devices[1].volume, 20)
+
+   def test_play_and_info(self):
+      self.command('play', device='Renderer 0', url='http://127.0.0.1/song.mp3')
+      self.assertEqual(self.renderer.devices[0].uri, 'http://127.0.0.1/song.mp3')
+      self.assertEqual(self.renderer.devices[0].state, 'PLAYING')
+      info = self.command('info', device='Renderer 0')
+      self.assertIn('PLAYING', str(info))
+
+   def test_browse(self):
+      objects = self.command('browse', device='Renderer 0', object_id='1')
+      self.assertEqual([o['title'] for o in objects], ['Track {}'.format(i) for i in range(5)])
+
+   def test_proxy_keeps_last_target_per_device(self):
+      self.command('play', device='Renderer 1', url='http://127.0.0.1/a.mp3', proxy=True)
+      first = self.renderer.devices[1].uri.split('/')[3]
+      self.assertEqual(dlnap._proxy_targets[first], 'http://127.0.0.1/a.mp3')
+
+      self.command('play', device='Renderer 1', url='http://127.0.0.1/b.mp3', proxy=True)
+      second = self.renderer.devices[1].uri.split('/')[3]
+      self.assertNotEqual(first, second)
+      self.assertNotIn(first, dlnap._proxy_targets)
+      self.assertEqual(dlnap._proxy_targets[second], 'http://127.0.0.1/b.mp3')
+
+   def test_unknown_action(self):
+      self.assertRaises(dlnap.DlnapError, self.command, 'dance')
+
+   def test_malformed_request(self):
+      sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+      sock.settimeout(10)
+      try:
+         sock.connect(self.socket_path)
+         sock.sendall(b'not json\n')
+         response = sock.makefile('rb').readline()
+      finally:
+         sock.close()
+      self.assertIn(b'"ok": false', response)
+
+class DaemonRegistryTest(unittest.TestCase):
+
+   def setUp(self):
+      logging.disable(logging.CRITICAL)
+      self.renderer = FakeRenderer().start()
+      self.daemon = dlnap.ControlDaemon(timeout=0.2, group=self.renderer.ssdp_address)
+
+   def tearDown(self):
+      self.renderer.stop()
+      for d in self.daemon.devices.values():
+         d.stop_scheduler(wait=False)
+      logging.disable(logging.NOTSET)
+
+   def test_rediscovered_device_replaces_known_one(self):
+      old = self.daemon.discover()[0]
+      new = self.daemon.discover()[0]
+      self.assertEqual(list(self.daemon.devices.values()), [new])
+      self.assertIs(self.daemon.devices[new.usn], new)
+      self.assertIsNone(old.scheduler)
+      self.assertIsNotNone(new.scheduler)
+
+   def test_device_with_new_address_is_rediscovered(self):
+      self.daemon.handle({'action': 'volume', 'volume': 20})
+      old = list(self.daemon.devices.values())[0]
+
+      # same device comes back on another port
+      self.renderer.stop()
+      self.renderer = FakeRenderer().start()
+      self.daemon.group = self.renderer.ssdp_address
+      old.retry_backoff = 0
+
+      self.daemon.handle({'action': 'volume', 'volume': 30})
+      self.assertEqual(self.renderer.devices[0].volume, 30)
+      d = self.daemon.devices[old.usn]
+      self.assertIsNot(d, old)
+      self.assertEqual(d.port, self.renderer.http_address[1])
+
+   def test_device_with_open_breaker_is_rediscovered(self):
+      old = self.daemon.discover()[0]
+      old.breaker = dlnap.CircuitBreaker(threshold=1)
+      old.breaker.record_failure()
+      self.assertIsNot(self.daemon.device(), old)
+      self.daemon.handle({'action': 'volume', 'volume': 25})
+      self.assertEqual(self.renderer.devices[0].volume, 25)
+
+   def test_missing_device_is_not_found(self):
+      self.assertRaises(dlnap.DlnapError, self.daemon.device, 'no such device')
+
+class ProxyPathTest(unittest.TestCase):
+
+   def test_slot_replaces_previous_target(self):
+      first = dlnap.proxy_path('/tmp/a.mp3', slot='test-slot')
+      self.assertEqual(dlnap.proxy_path('/tmp/a.mp3', slot='test-slot'), first)
+      second = dlnap.proxy_path('/tmp/b.mp3', slot='test-slot')
+      self.assertNotIn(first.split('/')[1], dlnap._proxy_targets)
+      self.assertEqual(dlnap._proxy_targets[second.split('/')[1]], '/tmp/b.mp3')
+
+   def test_unslotted_target_is_not_revoked_by_slot(self):
+      shared = dlnap.proxy_path('/tmp/c.mp3')
+      slotted = dlnap.proxy_path('/tmp/c.mp3', slot='other-slot')
+      self.assertNotEqual(shared, slotted)
+      dlnap.proxy_path('/tmp/d.mp3', slot='other-slot')
+      self.assertIn(shared.split('/')[1], dlnap._proxy_targets)
+      self.assertEqual(dlnap.proxy_path('/tmp/c.mp3'), shared)
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+
+# @file test_device.py
+# @brief DlnapDevice identity by USN and discovery dedupe tests.
+
+import os
+import sys
+import logging
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'dlnap'))
+sys.path.insert(0, os.path.join(HERE, '..', 'benchmarks'))
+
+import dlnap
+from fake_renderer import FakeRenderer
+
+class FetchCounter(dlnap.Metrics):
+   def __init__(self):
+      self.fetches = 0
+
+   def timing(self, event, seconds, **tags):
+      if event == 'description.fetch':
+         self.fetches += 1
+
+class DeviceIdentityTest(unittest.TestCase):
+
+   @classmethod
+   def setUpClass(cls):
+      logging.disable(logging.CRITICAL)
+      cls.renderer = FakeRenderer(count=3, library_size=1).start()
+      cls.counter = FetchCounter()
+      dlnap.set_metrics(cls.counter)
+      try:
+         # every device answers once per service: AVTransport, RenderingControl, ContentDirectory
+         cls.first = dlnap.discover(timeout=0.2, group=cls.renderer.ssdp_address)
+         cls.first_fetches = cls.counter.fetches
+         cls.second = dlnap.discover(timeout=0.2, group=cls.renderer.ssdp_address)
+      finally:
+         dlnap.set_metrics(None)
+
+   @classmethod
+   def tearDownClass(cls):
+      cls.renderer.stop()
+      logging.disable(logging.NOTSET)
+
+   def test_discover_returns_each_device_once(self):
+      self.assertEqual(sorted(d.usn for d in self.first), sorted(d.udn for d in self.renderer.devices))
+
+   def test_description_is_fetched_once_per_device(self):
+      self.assertEqual(self.first_fetches, 3)
+
+   def test_same_usn_devices_are_equal(self):
+      for d in self.first:
+         same = [s for s in self.second if s.usn == d.usn][0]
+         self.assertIsNot(d, same)
+         self.assertEqual(d, same)
+         self.assertFalse(d != same)
+         self.assertEqual(hash(d), hash(same))
+
+   def test_different_usn_devices_are_not_equal(self):
+      a, b = self.first[0], self.first[1]
+      self.assertNotEqual(a, b)
+      self.assertTrue(a != b)
+      self.assertNotEqual(a, a.usn)
+
+   def test_devices_are_deduped_in_sets_and_dicts(self):
+      self.assertEqual(len(set(self.first) | set(self.second)), 3)
+      by_device = dict((d, d.name) for d in self.first)
+      self.assertEqual(sorted(by_device[d] for d in self.second), sorted(d.name for d in self.first))
+
+if __name__ == '__main__':
+   unittest.main()
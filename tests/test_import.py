@@ -0,0 +1,28 @@
+#!/usr/bin/python
+
+# @file test_import.py
+# @brief Library import must stay lightweight and free of side effects, see benchmarks/bench_import.py.
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+from bench_import import HEAVY_MODULES, probe
+
+class ImportTest(unittest.TestCase):
+
+   @classmethod
+   def setUpClass(cls):
+      cls.result = probe(preload=True)
+
+   def test_no_heavy_modules_imported(self):
+      heavy = sorted(set(m for m in self.result['modules'] if m in HEAVY_MODULES))
+      self.assertEqual(heavy, [])
+
+   def test_sigint_handler_untouched(self):
+      self.assertTrue(self.result['sigint_default'])
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,142 @@
+#!/usr/bin/python
+
+# @file test_resolver.py
+# @brief UrlResolver dedupe, caching, expiry and timeout tests.
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dlnap'))
+
+import dlnap
+
+PAGE_URL = 'https://video.example/watch?v=1'
+
+class FakeResolver:
+   """ Resolver of video.example urls counting calls; the first resolution blocks until released.
+   """
+
+   def __init__(self, media_url = 'http://media.example/1.mp4?a=1&b=2'):
+      self.media_url = media_url
+      self.calls = 0
+      self.release = threading.Event()
+      self.release.set()
+      self.error = None
+
+   def match(self, url):
+      return url.startswith('https://video.example/')
+
+   def __call__(self, url):
+      self.calls += 1
+      if self.calls == 1:
+         self.release.wait(5)
+      if self.error is not None:
+         raise self.error
+      return self.media_url
+
+class UrlResolverTest(unittest.TestCase):
+
+   def resolver(self, ttl = 60, timeout = 5, **kwargs):
+      self.fake = FakeResolver(**kwargs)
+      resolver = dlnap.UrlResolver(ttl, timeout)
+      resolver.add(self.fake.match, self.fake)
+      return resolver
+
+   def test_unmatched_url_is_returned_as_is(self):
+      resolver = self.resolver()
+      resolution = resolver.resolve_async('http://host/song.mp3')
+      self.assertTrue(resolution.done())
+      self.assertEqual(resolution.result(), 'http://host/song.mp3')
+      self.assertEqual(self.fake.calls, 0)
+
+   def test_concurrent_requests_share_resolution(self):
+      resolver = self.resolver()
+      self.fake.release.clear()
+      first = resolver.resolve_async(PAGE_URL)
+      second = resolver.resolve_async(PAGE_URL)
+      self.assertIs(first, second)
+      self.fake.release.set()
+      self.assertEqual(first.result(5), self.fake.media_url)
+      self.assertEqual(self.fake.calls, 1)
+
+   def test_resolved_url_is_cached(self):
+      resolver = self.resolver()
+      self.assertEqual(resolver.resolve(PAGE_URL), self.fake.media_url)
+      resolution = resolver.resolve_async(PAGE_URL)
+      self.assertTrue(resolution.done())
+      self.assertEqual(resolution.result(), self.fake.media_url)
+      self.assertEqual(self.fake.calls, 1)
+
+   def test_cached_url_expires_after_ttl(self):
+      resolver = self.resolver(ttl=0.05)
+      resolver.resolve(PAGE_URL)
+      time.sleep(0.1)
+      resolver.resolve(PAGE_URL)
+      self.assertEqual(self.fake.calls, 2)
+
+   def test_stream_expire_parameter_limits_caching(self):
+      # stream url expiring in 30 s is too close to expiration to be reused
+      expire = int(time.time()) + 30
+      resolver = self.resolver(media_url='https://r1.example/videoplayback?expire={}&id=1'.format(expire))
+      resolver.resolve(PAGE_URL)
+      resolver.resolve(PAGE_URL)
+      self.assertEqual(self.fake.calls, 2)
+
+   def test_failure_is_not_cached(self):
+      resolver = self.resolver()
+      self.fake.error = dlnap.DlnapError('failed')
+      self.assertRaises(dlnap.DlnapError, resolver.resolve, PAGE_URL)
+      self.fake.error = None
+      self.assertEqual(resolver.resolve(PAGE_URL), self.fake.media_url)
+      self.assertEqual(self.fake.calls, 2)
+
+   def test_result_timeout(self):
+      resolver = self.resolver()
+      self.fake.release.clear()
+      resolution = resolver.resolve_async(PAGE_URL)
+      self.assertRaises(dlnap.DlnapError, resolution.result, 0.05)
+      self.fake.release.set()
+      self.assertEqual(resolution.result(5), self.fake.media_url)
+
+   def test_hung_resolution_is_not_shared_after_timeout(self):
+      resolver = self.resolver(timeout=0.1)
+      self.fake.release.clear()
+      start = time.time()
+      self.assertRaises(dlnap.DlnapError, resolver.resolve, PAGE_URL)
+      self.assertLess(time.time() - start, 1)
+
+      # the next request starts a new resolution instead of waiting for the hung one
+      self.assertEqual(resolver.resolve(PAGE_URL), self.fake.media_url)
+      self.assertEqual(self.fake.calls, 2)
+
+      # late completion of the hung resolution doesn't break later requests
+      self.fake.release.set()
+      time.sleep(0.05)
+      self.assertEqual(resolver.resolve(PAGE_URL), self.fake.media_url)
+      self.assertEqual(self.fake.calls, 2)
+
+   @unittest.skipUnless(os.name == 'posix', 'fake youtube-dl is a shell script')
+   def test_hung_youtube_dl_is_killed(self):
+      bin_dir = tempfile.mkdtemp()
+      path = os.environ['PATH']
+      try:
+         script = os.path.join(bin_dir, 'youtube-dl')
+         with open(script, 'w') as f:
+            f.write('#!/bin/sh\nexec sleep 30\n')
+         os.chmod(script, 0o755)
+         os.environ['PATH'] = bin_dir + os.pathsep + path
+
+         start = time.time()
+         self.assertRaises(dlnap.DlnapError, dlnap._youtube_dl, 'https://www.youtube.com/watch?v=x', 0.2)
+         self.assertLess(time.time() - start, 5)
+      finally:
+         os.environ['PATH'] = path
+         shutil.rmtree(bin_dir)
+
+if __name__ == '__main__':
+   unittest.main()
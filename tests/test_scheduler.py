@@ -0,0 +1,126 @@
+#!/usr/bin/python
+
+# @file test_scheduler.py
+# @brief CommandScheduler ordering and coalescing tests.
+
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dlnap'))
+
+import dlnap
+
+class BlockingSend:
+   """ Fake device send: records commands and holds the first one until released,
+   so that following commands pile up in the scheduler queue.
+   """
+
+   def __init__(self):
+      self.sent = []
+      self.started = threading.Event()
+      self.release = threading.Event()
+
+   def __call__(self, action, data):
+      self.sent.append((action, dict(data)))
+      if len(self.sent) == 1:
+         self.started.set()
+         self.release.wait(5)
+      return '{} done'.format(action)
+
+class CommandSchedulerTest(unittest.TestCase):
+
+   def setUp(self):
+      self.send = BlockingSend()
+      self.scheduler = dlnap.CommandScheduler(self.send)
+
+   def tearDown(self):
+      self.send.release.set()
+      self.scheduler.close()
+
+   def hold(self):
+      """ Submit a command which keeps the worker busy until released.
+      """
+      future = self.scheduler.submit('GetTransportInfo', {'InstanceID': 0})
+      self.assertTrue(self.send.started.wait(5))
+      return future
+
+   def volume(self, value, channel = 'Master'):
+      return self.scheduler.submit('SetVolume', {'InstanceID': 0, 'DesiredVolume': value, 'Channel': channel})
+
+   def test_superseded_volume_is_not_sent(self):
+      self.hold()
+      futures = [self.volume(v) for v in range(10)]
+      self.send.release.set()
+
+      for f in futures:
+         self.assertEqual(f.result(5), 'SetVolume done')
+      volumes = [data['DesiredVolume'] for action, data in self.send.sent if action == 'SetVolume']
+      self.assertEqual(volumes, [9])
+
+   def test_superseded_futures_complete_with_latest_result(self):
+      def send(action, data):
+         self.send(action, data)
+         return data.get('DesiredVolume')
+      self.scheduler = dlnap.CommandScheduler(send)
+
+      self.hold()
+      first, second = self.volume(1), self.volume(2)
+      self.send.release.set()
+      self.assertEqual(first.result(5), 2)
+      self.assertEqual(second.result(5), 2)
+
+   def test_superseded_futures_share_exception(self):
+      def send(action, data):
+         self.send(action, data)
+         if action == 'SetVolume':
+            raise dlnap.DlnapError('failed')
+      self.scheduler = dlnap.CommandScheduler(send)
+
+      self.hold()
+      futures = [self.volume(1), self.volume(2)]
+      self.send.release.set()
+      for f in futures:
+         self.assertRaises(dlnap.DlnapError, f.result, 5)
+
+   def test_order_is_kept_across_non_coalescable_commands(self):
+      self.hold()
+      self.volume(1)
+      self.scheduler.submit('Play', {'InstanceID': 0, 'Speed': 1})
+      last = self.volume(2)
+      self.send.release.set()
+      last.result(5)
+
+      sent = [(action, data.get('DesiredVolume')) for action, data in self.send.sent]
+      self.assertEqual(sent, [('GetTransportInfo', None), ('SetVolume', 1), ('Play', None), ('SetVolume', 2)])
+
+   def test_different_channels_are_not_coalesced(self):
+      self.hold()
+      self.volume(1, 'LF')
+      last = self.volume(2, 'RF')
+      self.send.release.set()
+      last.result(5)
+
+      sent = [(data['Channel'], data['DesiredVolume']) for action, data in self.send.sent if action == 'SetVolume']
+      self.assertEqual(sent, [('LF', 1), ('RF', 2)])
+
+   def test_other_commands_are_never_coalesced(self):
+      self.hold()
+      futures = [self.scheduler.submit('Play', {'InstanceID': 0, 'Speed': 1}) for i in range(3)]
+      self.send.release.set()
+      for f in futures:
+         f.result(5)
+      self.assertEqual([action for action, data in self.send.sent], ['GetTransportInfo', 'Play', 'Play', 'Play'])
+
+   def test_close_sends_queued_commands_and_rejects_new_ones(self):
+      self.hold()
+      future = self.volume(5)
+      self.send.release.set()
+      self.scheduler.close()
+
+      self.assertTrue(future.done())
+      self.assertRaises(RuntimeError, self.volume, 6)
+
+if __name__ == '__main__':
+   unittest.main()